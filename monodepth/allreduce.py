@@ -0,0 +1,153 @@
+import numpy as np
+import socket
+import struct
+import threading
+import time
+
+# Ring allreduce between training processes over TCP. Each worker listens on its own host:port,
+# connects to the next worker in the ring and accepts a connection from the previous one. Arrays
+# are reduced in worker_count chunks, so each worker sends and receives about twice the size of
+# the arrays per allreduce, independently of the number of workers.
+
+class RingAllreduce(object):
+    """Ring allreduce"""
+
+    def __init__(self, hosts, index, timeout = 600.0):
+        # hosts lists host:port for each worker, index is the position of this worker.
+        self.size = len(hosts)
+        self.index = index
+        if self.size == 1:
+            return
+
+        _, port = hosts[index].rsplit(":", 1)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("", int(port)))
+        listener.listen(1)
+
+        # Connect to the next worker, retrying until it listens.
+        next_host, next_port = hosts[(index + 1) % self.size].rsplit(":", 1)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.next = socket.create_connection((next_host, int(next_port)), timeout)
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+
+        listener.settimeout(timeout)
+        self.previous, _ = listener.accept()
+        listener.close()
+
+        # Blocking sockets without Nagle's algorithm, as every exchange waits for its reply.
+        for connection in [self.next, self.previous]:
+            connection.settimeout(None)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # Check that the ring is ordered as expected.
+        self.next.sendall(struct.pack("!i", index))
+        previous_index = struct.unpack("!i", self.receive_bytes(4))[0]
+        if previous_index != (index - 1) % self.size:
+            raise ValueError("Worker {} expected worker {} before it in the ring, got worker {}.".format(
+                index, (index - 1) % self.size, previous_index))
+
+    def receive_bytes(self, num_bytes):
+        data = bytearray(num_bytes)
+        self.receive_into(memoryview(data))
+        return bytes(data)
+
+    def receive_into(self, view):
+        received = 0
+        while received < len(view):
+            num_bytes = self.previous.recv_into(view[received:])
+            if num_bytes == 0:
+                raise IOError("Worker {} lost the connection to the previous worker.".format(self.index))
+            received += num_bytes
+
+    def exchange(self, send_buffer, receive_buffer):
+        # Sends to the next worker while receiving from the previous one, so that large buffers
+        # do not block on full socket buffers.
+        errors = []
+        def send():
+            try:
+                self.next.sendall(memoryview(send_buffer.view(np.uint8)))
+            except Exception as error:
+                errors.append(error)
+        sender = threading.Thread(target = send)
+        sender.start()
+        self.receive_into(memoryview(receive_buffer.view(np.uint8)))
+        sender.join()
+        if errors:
+            raise errors[0]
+
+    def allreduce(self, arrays, bucket_size = 2 ** 22):
+        # Returns the float32 averages of a list of arrays over all workers, computed in place where
+        # the arrays allow it. Small arrays are reduced together in buckets of up to bucket_size
+        # elements, so that they share exchanges while the memory overhead stays bounded.
+        arrays = [np.require(array, np.float32, ["C", "W"]) for array in arrays]
+        if self.size == 1:
+            return arrays
+
+        start = 0
+        while start < len(arrays):
+            end = start + 1
+            num_elements = arrays[start].size
+            while end < len(arrays) and num_elements + arrays[end].size <= bucket_size:
+                num_elements += arrays[end].size
+                end += 1
+
+            if end - start == 1:
+                self.average(arrays[start].reshape(-1))
+            else:
+                buffer = np.concatenate([array.reshape(-1) for array in arrays[start:end]])
+                self.average(buffer)
+                offset = 0
+                for array in arrays[start:end]:
+                    array.reshape(-1)[:] = buffer[offset:offset + array.size]
+                    offset += array.size
+            start = end
+        return arrays
+
+    def average(self, buffer):
+        # Averages a flat float32 buffer over all workers in place.
+        chunks = np.array_split(buffer, self.size)
+        received = np.empty(len(chunks[0]), np.float32)
+
+        # Reduce-scatter, after which this worker holds the sum of chunk index + 1.
+        for step in range(self.size - 1):
+            send_chunk = chunks[(self.index - step) % self.size]
+            receive_chunk = chunks[(self.index - step - 1) % self.size]
+            self.exchange(send_chunk, received[:len(receive_chunk)])
+            receive_chunk += received[:len(receive_chunk)]
+
+        # Allgather of the summed chunks.
+        for step in range(self.size - 1):
+            send_chunk = chunks[(self.index - step + 1) % self.size]
+            receive_chunk = chunks[(self.index - step) % self.size]
+            self.exchange(send_chunk, receive_chunk)
+
+        buffer /= self.size
+
+    def broadcast(self, arrays, root = 0):
+        # Returns the arrays of the root worker on all workers, passed along the ring.
+        arrays = [np.asarray(array) for array in arrays]
+        if self.size == 1:
+            return arrays
+
+        results = []
+        for array in arrays:
+            buffer = np.ascontiguousarray(array).reshape(array.shape)
+            if self.index != root:
+                buffer = np.empty_like(buffer)
+                self.receive_into(memoryview(buffer.reshape(-1).view(np.uint8)))
+            if (self.index + 1) % self.size != root:
+                self.next.sendall(memoryview(buffer.reshape(-1).view(np.uint8)))
+            results.append(buffer)
+        return results
+
+    def close(self):
+        if self.size > 1:
+            self.next.close()
+            self.previous.close()
@@ -0,0 +1,51 @@
+import numpy as np
+import socket
+import threading
+
+from allreduce import RingAllreduce
+
+def ring_allreduce_test():
+    # Average arrays over three ring workers on localhost threads. Integer values keep the sums
+    # exact, so every worker must return exactly the mean, including for a length that does not
+    # split evenly between the workers and for small arrays reduced together in one bucket.
+    num_workers = 3
+    ports = []
+    for _ in range(num_workers):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("localhost", 0))
+        ports.append(probe.getsockname()[1])
+        probe.close()
+    hosts = ["localhost:{}".format(port) for port in ports]
+
+    shapes = [[1000003], [3, 5], [], [7]]
+    arrays = [[np.random.randint(-1000, 1000, shape).astype(np.float32) for shape in shapes] for _ in range(num_workers)]
+    expected = [np.sum([worker_arrays[index] for worker_arrays in arrays], 0) / np.float32(num_workers)
+                for index in range(len(shapes))]
+
+    results = [None] * num_workers
+    broadcasts = [None] * num_workers
+    errors = []
+    def work(index):
+        try:
+            ring = RingAllreduce(hosts, index, timeout = 60.0)
+            results[index] = ring.allreduce([array.copy() for array in arrays[index]], bucket_size = 64)
+            broadcasts[index] = ring.broadcast(arrays[index])
+            ring.close()
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target = work, args = (index,)) for index in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    for index in range(num_workers):
+        for result, broadcast, mean, root_array in zip(results[index], broadcasts[index], expected, arrays[0]):
+            assert result.shape == mean.shape and np.array_equal(result, mean)
+            assert broadcast.shape == root_array.shape and np.array_equal(broadcast, root_array)
+    print("ring_allreduce: {} workers agree on the exact mean".format(num_workers))
+
+if __name__ == "__main__":
+    ring_allreduce_test()
@@ -14,81 +14,86 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import numpy as np
 import tensorflow as tf
 
-def repeat(x, n_repeats):
-    with tf.variable_scope("repeat"):
-        rep = tf.transpose(
-            tf.expand_dims(tf.ones(shape=tf.stack([n_repeats, ])), 1), [1, 0])
-        rep = tf.cast(rep, "int32")
-        x = tf.matmul(tf.reshape(x, (-1, 1)), rep)
-        return tf.reshape(x, [-1])
-
-
-def interpolate(input_images, x, y, out_size):
+# Offsets of each image in the flattened batch, cached per static shape.
+batch_offsets_cache = {}
+
+def batch_offsets(input_images):
+    # Returns [batch, 1] offsets, broadcast against [1 or batch, num_points] indices.
+    shape = input_images.get_shape()
+    if shape.ndims == 4 and shape[:3].is_fully_defined():
+        batch_size, height, width = shape[:3].as_list()
+        key = (batch_size, height, width)
+        if key not in batch_offsets_cache:
+            batch_offsets_cache[key] = np.reshape(np.arange(batch_size) * height * width, [-1, 1]).astype(np.int32)
+        return tf.constant(batch_offsets_cache[key])
+
+    shape = tf.shape(input_images)
+    return tf.reshape(tf.range(shape[0]) * shape[1] * shape[2], [-1, 1])
+
+def interpolate(input_images, x, y, wrap = False):
+    # Samples at x, y of shape [batch, num_points] (or [1, num_points] if shared by the whole
+    # batch), in [0, 1] image coordinates. Returns [batch, num_points, channels].
+    # If wrap is set, columns wrap around horizontally (equirectangular longitude) instead of
+    # being clamped to the border. x is then periodic with period 1, column i being at i / width.
     with tf.variable_scope("interpolate"):
         # Shape constants.
-        num_batch = tf.shape(input_images)[0]
         height = tf.shape(input_images)[1]
         width = tf.shape(input_images)[2]
         channels = tf.shape(input_images)[3]
+        max_y = height - 1
+        max_x = width - 1
+
+        # Scale indices from [0, 1] to [0, width - 1] or [0, height - 1], or to [0, width) if wrapping.
+        x = tf.cast(x, "float32") * tf.cast(width if wrap else max_x, "float32")
+        y = tf.cast(y, "float32") * tf.cast(max_y, "float32")
+
+        # Neighbour coordinates. Weights use the clamped coordinates, as before.
+        x0_f = tf.floor(x)
+        y0_f = tf.floor(y)
+        x0 = tf.cast(x0_f, "int32")
+        y0 = tf.cast(y0_f, "int32")
+        if wrap:
+            x1 = tf.mod(x0 + 1, width)
+            x0 = tf.mod(x0, width)
+            x1_f = x0_f + 1.0
+        else:
+            x1 = tf.clip_by_value(x0 + 1, 0, max_x)
+            x0 = tf.clip_by_value(x0, 0, max_x)
+            x0_f = tf.cast(x0, "float32")
+            x1_f = tf.cast(x1, "float32")
+        y1 = tf.clip_by_value(y0 + 1, 0, max_y)
+        y0 = tf.clip_by_value(y0, 0, max_y)
+        y0_f = tf.cast(y0, "float32")
+        y1_f = tf.cast(y1, "float32")
+
+        # Gather the 2x2 neighbourhood of every point at once.
+        base = batch_offsets(input_images)
+        base_y0 = base + y0 * width
+        base_y1 = base + y1 * width
+        indices = tf.stack([base_y0 + x0, base_y1 + x0, base_y0 + x1, base_y1 + x1])
 
-        x = tf.cast(x, "float32")
-        y = tf.cast(y, "float32")
-        height_f = tf.cast(height, "float32")
-        width_f = tf.cast(width, "float32")
-        out_height = out_size[0]
-        out_width = out_size[1]
-        zero = tf.zeros([], dtype="int32")
-        max_y = tf.cast(tf.shape(input_images)[1] - 1, "int32")
-        max_x = tf.cast(tf.shape(input_images)[2] - 1, "int32")
-
-        # Scale indices from [0, 1] to [0, width - 1] or [0, height - 1]
-        x = x * (width_f - 1)
-        y = y * (height_f - 1)
-
-        # Do sampling.
-        x0 = tf.cast(tf.floor(x), "int32")
-        x1 = x0 + 1
-        y0 = tf.cast(tf.floor(y), "int32")
-        y1 = y0 + 1
-
-        x0 = tf.clip_by_value(x0, zero, max_x)
-        x1 = tf.clip_by_value(x1, zero, max_x)
-        y0 = tf.clip_by_value(y0, zero, max_y)
-        y1 = tf.clip_by_value(y1, zero, max_y)
-        dim2 = width
-        dim1 = width * height
-        base = repeat(tf.range(num_batch) * dim1, out_height * out_width)
-        base_y0 = base + y0 * dim2
-        base_y1 = base + y1 * dim2
-        idx_a = base_y0 + x0
-        idx_b = base_y1 + x0
-        idx_c = base_y0 + x1
-        idx_d = base_y1 + x1
-
-        # Use indices to lookup pixels in the flat image and restore
-        # channels dimension.
         im_flat = tf.reshape(input_images, tf.stack([-1, channels]))
-        im_flat = tf.cast(im_flat, "float32")
-        Ia = tf.gather(im_flat, idx_a)
-        Ib = tf.gather(im_flat, idx_b)
-        Ic = tf.gather(im_flat, idx_c)
-        Id = tf.gather(im_flat, idx_d)
+        if im_flat.dtype != tf.float32:
+            im_flat = tf.cast(im_flat, "float32")
+        Ia, Ib, Ic, Id = tf.unstack(tf.gather(im_flat, indices))
 
         # Finally calculate interpolated values.
-        x0_f = tf.cast(x0, "float32")
-        x1_f = tf.cast(x1, "float32")
-        y0_f = tf.cast(y0, "float32")
-        y1_f = tf.cast(y1, "float32")
-        wa = tf.expand_dims(((x1_f - x) * (y1_f - y)), 1)
-        wb = tf.expand_dims(((x1_f - x) * (y - y0_f)), 1)
-        wc = tf.expand_dims(((x - x0_f) * (y1_f - y)), 1)
-        wd = tf.expand_dims(((x - x0_f) * (y - y0_f)), 1)
-        output = tf.add_n([wa * Ia, wb * Ib, wc * Ic, wd * Id])
-        return output
-
-def transform(input_images, x_t, y_t, x_offset, y_offset):
+        wa = tf.expand_dims(((x1_f - x) * (y1_f - y)), 2)
+        wb = tf.expand_dims(((x1_f - x) * (y - y0_f)), 2)
+        wc = tf.expand_dims(((x - x0_f) * (y1_f - y)), 2)
+        wd = tf.expand_dims(((x - x0_f) * (y - y0_f)), 2)
+        return tf.add_n([wa * Ia, wb * Ib, wc * Ic, wd * Id])
+
+def flatten_offset(offset, batch_size):
+    offset = tf.convert_to_tensor(offset, "float32")
+    if offset.get_shape().ndims == 0:
+        return offset
+    return tf.reshape(offset, tf.stack([batch_size, -1]))
+
+def transform(input_images, x_t, y_t, x_offset, y_offset, wrap = False):
     with tf.variable_scope("transform"):
         batch_size   = tf.shape(input_images)[0]
         num_channels = tf.shape(input_images)[3]
@@ -96,34 +101,95 @@ def transform(input_images, x_t, y_t, x_offset, y_offset):
         out_height = tf.shape(x_t)[0]
         out_width = tf.shape(x_t)[1]
 
-        x_t_flat = tf.reshape(x_t, (1, -1))
-        y_t_flat = tf.reshape(y_t, (1, -1))
-
-        x_t_flat = tf.tile(x_t_flat, tf.stack([batch_size, 1]))
-        y_t_flat = tf.tile(y_t_flat, tf.stack([batch_size, 1]))
+        # Grids are shared by the batch and broadcast against per-image offsets.
+        x_t_flat = tf.reshape(x_t, (1, -1)) + flatten_offset(x_offset, batch_size)
+        y_t_flat = tf.reshape(y_t, (1, -1)) + flatten_offset(y_offset, batch_size)
 
-        x_t_flat = tf.reshape(x_t_flat, [-1])
-        y_t_flat = tf.reshape(y_t_flat, [-1])
-
-        x_t_flat = x_t_flat + tf.reshape(x_offset, [-1])
-        y_t_flat = y_t_flat + tf.reshape(y_offset, [-1])
-
-        input_transformed = interpolate(input_images, x_t_flat, y_t_flat, [out_height, out_width])
+        input_transformed = interpolate(input_images, x_t_flat, y_t_flat, wrap)
 
         output = tf.reshape(
             input_transformed, tf.stack([batch_size, out_height, out_width, num_channels]))
         return output
 
-def uv_grid(shape):
-    u, v = tf.meshgrid(tf.linspace(0.0, 1.0, shape[1]), tf.linspace(0.0, 1.0, shape[0]))
+def uv_grid(shape, wrap = False):
+    # Pixel centres in [0, 1] image coordinates, or at i / width horizontally if wrapping.
+    if wrap:
+        u = tf.cast(tf.range(shape[1]), "float32") / tf.cast(shape[1], "float32")
+    else:
+        u = tf.linspace(0.0, 1.0, shape[1])
+    u, v = tf.meshgrid(u, tf.linspace(0.0, 1.0, shape[0]))
     return u, v
 
-def bilinear_sample(input_images, x_t = None, y_t = None, x_offset = 0.0, y_offset = 0.0, name = "bilinear_sampler", **kwargs):
+def bilinear_sample(input_images, x_t = None, y_t = None, x_offset = 0.0, y_offset = 0.0, name = "bilinear_sampler", wrap = False, **kwargs):
     with tf.variable_scope(name):
         height       = tf.shape(input_images)[1]
         width        = tf.shape(input_images)[2]
 
         if x_t is None and y_t is None:
-            x_t, y_t = uv_grid([height, width])
+            x_t, y_t = uv_grid([height, width], wrap)
+
+        return transform(input_images, x_t, y_t, x_offset, y_offset, wrap)
 
-        return transform(input_images, x_t, y_t, x_offset, y_offset)
+def vertical_sample(input_images, y_offset, name = "vertical_sampler"):
+    # Equivalent to bilinear_sample(input_images, y_offset = y_offset) for a [batch, height, width, 1]
+    # offset, up to float32 round-off. Columns stay fixed, so sampling reduces to linear interpolation
+    # along each column with two gathers instead of four.
+    with tf.variable_scope(name):
+        batch_size = tf.shape(input_images)[0]
+        height = tf.shape(input_images)[1]
+        width = tf.shape(input_images)[2]
+        num_channels = tf.shape(input_images)[3]
+        max_y = height - 1
+        max_x = width - 1
+
+        # Scale rows from [0, 1] to [0, height - 1].
+        y_t = tf.reshape(tf.linspace(0.0, 1.0, height), tf.stack([1, height, 1]))
+        y = (y_t + tf.reshape(y_offset, tf.stack([batch_size, height, width]))) * tf.cast(max_y, "float32")
+
+        y0 = tf.cast(tf.floor(y), "int32")
+        y1 = tf.clip_by_value(y0 + 1, 0, max_y)
+        y0 = tf.clip_by_value(y0, 0, max_y)
+
+        base = tf.expand_dims(batch_offsets(input_images), 2) + tf.reshape(tf.range(width), [1, 1, -1])
+        idx_0 = tf.reshape(base + y0 * width, [-1])
+        idx_1 = tf.reshape(base + y1 * width, [-1])
+
+        im_flat = tf.reshape(input_images, tf.stack([-1, num_channels]))
+        if im_flat.dtype != tf.float32:
+            im_flat = tf.cast(im_flat, "float32")
+        I0 = tf.gather(im_flat, idx_0)
+        I1 = tf.gather(im_flat, idx_1)
+
+        # Linear weights along the column.
+        y_flat = tf.reshape(y, [-1, 1])
+        w0 = tf.cast(tf.reshape(y1, [-1, 1]), "float32") - y_flat
+        w1 = y_flat - tf.cast(tf.reshape(y0, [-1, 1]), "float32")
+        output = tf.reshape(w0 * I0 + w1 * I1, tf.shape(input_images))
+
+        # Column weights of bilinear_sample, which clamps both horizontal neighbours of the last
+        # column to the same pixel and so gives it zero weight.
+        x = tf.linspace(0.0, 1.0, width) * tf.cast(max_x, "float32")
+        x0 = tf.clip_by_value(tf.floor(x), 0.0, tf.cast(max_x, "float32"))
+        x1 = tf.clip_by_value(x0 + 1.0, 0.0, tf.cast(max_x, "float32"))
+        return output * tf.reshape(x1 - x0, [1, 1, -1, 1])
+
+def remap(input_images, indices, weights, out_size, name = "remap"):
+    # Sample with a precomputed map of flat neighbour indices and bilinear weights
+    # ([N, 4] each, shared across the batch), using a single gather.
+    with tf.variable_scope(name):
+        batch_size = tf.shape(input_images)[0]
+        num_channels = tf.shape(input_images)[3]
+
+        # Move pixels to the leading axis so that one gather serves the whole batch.
+        pixels = tf.reshape(tf.transpose(input_images, [1, 2, 0, 3]), tf.stack([-1, batch_size, num_channels]))
+        if pixels.dtype != tf.float32:
+            pixels = tf.cast(pixels, tf.float32)
+
+        neighbours = tf.gather(pixels, tf.constant(indices.reshape([-1])))
+        neighbours = tf.reshape(neighbours, tf.stack([-1, 4, batch_size, num_channels]))
+        output = tf.reduce_sum(neighbours * tf.constant(weights.reshape([-1, 4, 1, 1])), 1)
+
+        output = tf.reshape(output, tf.stack([out_size[0], out_size[1], batch_size, num_channels]))
+        output = tf.transpose(output, [2, 0, 1, 3])
+        output.set_shape([input_images.get_shape()[0], out_size[0], out_size[1], input_images.get_shape()[3]])
+        return output
@@ -0,0 +1,112 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import time
+
+from bilinear_sampler import bilinear_sample
+
+# Microbenchmark for bilinear_sample against the previous sampler, which repeated the
+# batch offsets with a matmul, issued four gathers and always cast the image.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Bilinear sampler benchmark.")
+    parser.add_argument("--batch_size", type = int, help = "Batch size.", default = 8)
+    parser.add_argument("--height", type = int, help = "Image height.", default = 256)
+    parser.add_argument("--width", type = int, help = "Image width.", default = 512)
+    parser.add_argument("--iterations", type = int, help = "Number of timed iterations.", default = 20)
+    return parser.parse_args()
+
+def reference_repeat(x, n_repeats):
+    rep = tf.transpose(
+        tf.expand_dims(tf.ones(shape=tf.stack([n_repeats, ])), 1), [1, 0])
+    rep = tf.cast(rep, "int32")
+    x = tf.matmul(tf.reshape(x, (-1, 1)), rep)
+    return tf.reshape(x, [-1])
+
+def reference_interpolate(input_images, x, y, out_size):
+    num_batch = tf.shape(input_images)[0]
+    height = tf.shape(input_images)[1]
+    width = tf.shape(input_images)[2]
+    channels = tf.shape(input_images)[3]
+
+    x = tf.cast(x, "float32") * (tf.cast(width, "float32") - 1)
+    y = tf.cast(y, "float32") * (tf.cast(height, "float32") - 1)
+
+    x0 = tf.cast(tf.floor(x), "int32")
+    x1 = x0 + 1
+    y0 = tf.cast(tf.floor(y), "int32")
+    y1 = y0 + 1
+
+    x0 = tf.clip_by_value(x0, 0, width - 1)
+    x1 = tf.clip_by_value(x1, 0, width - 1)
+    y0 = tf.clip_by_value(y0, 0, height - 1)
+    y1 = tf.clip_by_value(y1, 0, height - 1)
+    base = reference_repeat(tf.range(num_batch) * width * height, out_size[0] * out_size[1])
+    base_y0 = base + y0 * width
+    base_y1 = base + y1 * width
+
+    im_flat = tf.cast(tf.reshape(input_images, tf.stack([-1, channels])), "float32")
+    Ia = tf.gather(im_flat, base_y0 + x0)
+    Ib = tf.gather(im_flat, base_y1 + x0)
+    Ic = tf.gather(im_flat, base_y0 + x1)
+    Id = tf.gather(im_flat, base_y1 + x1)
+
+    x0_f = tf.cast(x0, "float32")
+    x1_f = tf.cast(x1, "float32")
+    y0_f = tf.cast(y0, "float32")
+    y1_f = tf.cast(y1, "float32")
+    wa = tf.expand_dims(((x1_f - x) * (y1_f - y)), 1)
+    wb = tf.expand_dims(((x1_f - x) * (y - y0_f)), 1)
+    wc = tf.expand_dims(((x - x0_f) * (y1_f - y)), 1)
+    wd = tf.expand_dims(((x - x0_f) * (y - y0_f)), 1)
+    return tf.add_n([wa * Ia, wb * Ib, wc * Ic, wd * Id])
+
+def reference_bilinear_sample(input_images, x_offset, y_offset):
+    batch_size = tf.shape(input_images)[0]
+    height = tf.shape(input_images)[1]
+    width = tf.shape(input_images)[2]
+    num_channels = tf.shape(input_images)[3]
+
+    x_t, y_t = tf.meshgrid(tf.linspace(0.0, 1.0, width), tf.linspace(0.0, 1.0, height))
+    x_t_flat = tf.reshape(tf.tile(tf.reshape(x_t, (1, -1)), tf.stack([batch_size, 1])), [-1]) + tf.reshape(x_offset, [-1])
+    y_t_flat = tf.reshape(tf.tile(tf.reshape(y_t, (1, -1)), tf.stack([batch_size, 1])), [-1]) + tf.reshape(y_offset, [-1])
+
+    output = reference_interpolate(input_images, x_t_flat, y_t_flat, [height, width])
+    return tf.reshape(output, tf.stack([batch_size, height, width, num_channels]))
+
+def time_op(session, op, iterations):
+    session.run(op)
+    start = time.time()
+    for _ in range(iterations):
+        session.run(op)
+    return (time.time() - start) / iterations
+
+def benchmark(arguments):
+    shape = [arguments.batch_size, arguments.height, arguments.width]
+    images = tf.Variable(tf.random_uniform(shape + [3]))
+    x_offset = tf.Variable(tf.random_uniform(shape + [1], -0.1, 0.1))
+    y_offset = tf.Variable(tf.random_uniform(shape + [1], -0.1, 0.1))
+
+    reference = reference_bilinear_sample(images, x_offset, y_offset)
+    output = bilinear_sample(images, x_offset = x_offset, y_offset = y_offset)
+
+    # Forward and backward passes, as used by the training losses.
+    reference_gradients = tf.gradients(tf.reduce_sum(reference), [x_offset, y_offset])
+    gradients = tf.gradients(tf.reduce_sum(output), [x_offset, y_offset])
+
+    session = tf.Session()
+    session.run(tf.global_variables_initializer())
+
+    error = np.abs(session.run(reference - output)).max()
+    print("Maximum difference: {:.3e}".format(error))
+
+    for name, reference_op, op in [("forward", reference, output), ("backward", reference_gradients, gradients)]:
+        reference_time = time_op(session, reference_op, arguments.iterations)
+        new_time = time_op(session, op, arguments.iterations)
+        print("{:>8}: previous {:.2f} ms, current {:.2f} ms, speedup {:.2f}x".format(
+            name, 1000.0 * reference_time, 1000.0 * new_time, reference_time / new_time))
+
+if __name__ == "__main__":
+    benchmark(parse_args())
@@ -20,12 +20,12 @@ def parse_args():
     return arguments
 
 def pad_and_crop(images, width, height, pad_width, pad_height):
-    start_width = (width - pad_width) / 2
+    start_width = (width - pad_width) // 2
     end_width = start_width + pad_width
 
     crop_images = images[:, :, start_width:end_width, :]
 
-    top_pad = (pad_height - height) / 2
+    top_pad = (pad_height - height) // 2
     bottom_pad = pad_height - (top_pad + height)
 
     pad_and_crop_images = tf.pad(crop_images, [[0, 0], [bottom_pad, top_pad], [0, 0], [0, 0]])
@@ -43,6 +43,12 @@ def convert():
     tf_depth_filenames = tf.placeholder(tf.string, [4])
     rgbs = [tf_read_png(tf_rgb_filenames[index]) for index in range(4)]
     depths = [tf_read_raw(tf_depth_filenames[index])[:, :, :, 0:1] for index in range(4)]
+
+    # Static face shapes, so that cubic_to_equirectangular samples through a cached projection map.
+    for rgb in rgbs:
+        rgb.set_shape([1, height, width, 3])
+    for depth in depths:
+        depth.set_shape([1, height, width, 1])
     rgbs.extend([tf.zeros([1, height, width, 3], tf.float32) for _ in range(2)])
     depths.extend([tf.zeros([1, height, width, 1], tf.uint16) for _ in range(2)])
 
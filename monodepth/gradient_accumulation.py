@@ -0,0 +1,37 @@
+import tensorflow as tf
+
+# Gradient accumulation over several micro-batches before a single optimizer update, for large
+# effective batches at high resolutions. Accumulators are local variables, so checkpoints are
+# the same as without accumulation.
+
+class GradientAccumulator(object):
+    """Gradient accumulator"""
+
+    def __init__(self, grads_and_vars, num_steps):
+        self.grads_and_vars = grads_and_vars
+        self.num_steps = num_steps
+
+        self.accumulators = []
+        with tf.variable_scope("gradient_accumulation"):
+            for index, (grad, var) in enumerate(grads_and_vars):
+                if grad is None:
+                    self.accumulators.append(None)
+                    continue
+                self.accumulators.append(tf.get_variable("accumulator_{}".format(index), shape = var.get_shape(), dtype = grad.dtype,
+                                                         initializer = tf.zeros_initializer(), trainable = False,
+                                                         collections = [tf.GraphKeys.LOCAL_VARIABLES]))
+
+        self.accumulate_op = tf.group(*[accumulator.assign_add(grad) for (grad, _), accumulator
+                                        in zip(grads_and_vars, self.accumulators) if accumulator is not None])
+
+    def average_gradients(self):
+        # Averages over the micro-batches, read after the current micro-batch has been added.
+        with tf.control_dependencies([self.accumulate_op]):
+            return [(None if accumulator is None else accumulator.read_value() / float(self.num_steps), var)
+                    for accumulator, (_, var) in zip(self.accumulators, self.grads_and_vars)]
+
+    def reset_after(self, op):
+        # Clears the accumulators once op (the optimizer update) has run.
+        with tf.control_dependencies([op]):
+            return tf.group(*[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in self.accumulators
+                              if accumulator is not None])
@@ -31,6 +31,17 @@ def encode_image(image, type = "jpg", index = 0):
 def encode_images(images, batch_size, type = "jpg"):
     return [encode_image(images, type, index) for index in range(batch_size)]
 
+def encode_batch(images, type = "jpg"):
+    # One encoding op for the whole batch, returns a string per image.
+    quantized_images = tf.image.convert_image_dtype(images, tf.uint8)
+    encode = tf.image.encode_png if type == "png" else tf.image.encode_jpeg
+    return tf.map_fn(encode, quantized_images, dtype = tf.string, back_prop = False)
+
+def encode_depth_png(depths, scale):
+    # 16-bit PNG per image, storing depth * scale. Depths beyond 65535 / scale are clipped.
+    quantized_depths = tf.cast(tf.clip_by_value(tf.round(depths * scale), 0.0, 65535.0), tf.uint16)
+    return tf.map_fn(tf.image.encode_png, quantized_depths, dtype = tf.string, back_prop = False)
+
 def write_image(image_data, filename):
     with open(filename, "wb") as image_file:
         image_file.write(image_data)
@@ -98,18 +109,14 @@ def normalize(images):
     max = tf.reduce_max(images, [1, 2], keep_dims = True)
     return (images - min) / (max - min)
 
-def restore(images, target_height):
-    batch_size = tf.shape(images)[0]
-    height = tf.shape(images)[1]
-    width = tf.shape(images)[2]
-    channels = tf.shape(images)[3]
-
-    th = tf.cast((target_height - height) / 2.0, tf.int32)
+def restore(images, target_height, mode = "CONSTANT"):
+    # Pads images cropped about the equator back to target_height, with zero rows by default.
+    height = images.get_shape()[1].value
+    if height is None:
+        height = tf.shape(images)[1]
+    th = (target_height - height) // 2
     bh = target_height - (height + th)
-
-    tz = tf.zeros([batch_size, th, width, channels], dtype = tf.float32)
-    bz = tf.zeros([batch_size, bh, width, channels], dtype = tf.float32)
-    return tf.concat([tz, images, bz], 2)
+    return tf.pad(images, [[0, 0], [th, bh], [0, 0], [0, 0]], mode = mode)
 
 def write_pc(pc, filename):
     num_points = pc.shape[0]
@@ -0,0 +1,126 @@
+import collections
+import contextlib
+import json
+import numpy as np
+import os
+import tensorflow as tf
+import time
+
+from tensorflow.python.client import timeline
+
+# Instrumentation for the training and test loops. Stage timers show where the wall time of a
+# loop goes, the queue fill levels of the dataloader and the input wait from step traces show
+# whether a run is input bound, and reports are appended to a JSON-lines metrics file.
+
+# Ops that wait on the input pipeline in step traces.
+input_ops = ["QueueDequeue", "IteratorGetNext"]
+
+class StageTimer(object):
+    """Stage timer"""
+
+    def __init__(self, percentiles = (50, 90, 99)):
+        self.percentiles = percentiles
+        self.durations = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def add(self, stage, duration):
+        self.durations.setdefault(stage, []).append(duration)
+
+    def summary(self):
+        # Count, total, mean and percentiles in seconds of each stage since the last reset.
+        summary = collections.OrderedDict()
+        for stage, durations in self.durations.items():
+            stage_summary = collections.OrderedDict([("count", len(durations)), ("total", float(np.sum(durations))),
+                                                     ("mean", float(np.mean(durations)))])
+            for percentile, value in zip(self.percentiles, np.percentile(durations, self.percentiles)):
+                stage_summary["p{}".format(percentile)] = float(value)
+            summary[stage] = stage_summary
+        return summary
+
+    def reset(self):
+        self.durations = collections.OrderedDict()
+
+def format_stages(stages, queues):
+    # One line with the median and 90th percentile of each stage, and the mean queue fill levels.
+    strings = ["{} {:.3f}s p90 {:.3f}s".format(stage, summary["p50"], summary["p90"]) for stage, summary in stages.items()]
+    strings += ["{} {:.0f}% full".format(name, 100 * summary["mean"]) for name, summary in queues.items()]
+    return " | ".join(strings)
+
+class QueueSampler(object):
+    """Queue fill level sampler"""
+
+    def __init__(self, queue_fill_levels):
+        # queue_fill_levels maps queue names to tensors of their fill fraction.
+        self.names = list(queue_fill_levels.keys())
+        self.fetches = [queue_fill_levels[name] for name in self.names]
+        self.samples = [[] for _ in self.names]
+
+    def add(self, values):
+        # Values of fetches, run together with a step.
+        for samples, value in zip(self.samples, values):
+            samples.append(float(value))
+
+    def summary(self):
+        summary = collections.OrderedDict()
+        for name, samples in zip(self.names, self.samples):
+            if samples:
+                summary[name] = collections.OrderedDict([("mean", float(np.mean(samples))), ("min", float(np.min(samples)))])
+        return summary
+
+    def reset(self):
+        self.samples = [[] for _ in self.names]
+
+class StepTracer(object):
+    """Step tracer"""
+
+    def __init__(self, trace_directory, trace_every):
+        self.trace_directory = trace_directory
+        self.trace_every = trace_every
+        if trace_every > 0 and not os.path.isdir(trace_directory):
+            os.makedirs(trace_directory)
+
+    def should_trace(self, step):
+        return self.trace_every > 0 and step % self.trace_every == 0
+
+    def run(self, session, fetches, step):
+        # Runs a traced step, writes it as Chrome trace JSON and returns the results with the
+        # time spent waiting on the input pipeline.
+        run_metadata = tf.RunMetadata()
+        results = session.run(fetches, options = tf.RunOptions(trace_level = tf.RunOptions.FULL_TRACE),
+                              run_metadata = run_metadata)
+
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+        with open(os.path.join(self.trace_directory, "trace_{}.json".format(step)), "w") as trace_file:
+            trace_file.write(trace)
+
+        input_wait = 0
+        for device_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                if any(op in node_stats.timeline_label for op in input_ops):
+                    input_wait += node_stats.all_end_rel_micros
+        return results, input_wait / 1e6
+
+class MetricsLog(object):
+    """JSON-lines metrics log"""
+
+    def __init__(self, path):
+        self.metrics_file = open(path, "a") if path else None
+
+    def write(self, **record):
+        if self.metrics_file is None:
+            return
+        record["time"] = time.time()
+        self.metrics_file.write(json.dumps(record) + "\n")
+        self.metrics_file.flush()
+
+    def close(self):
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
@@ -0,0 +1,53 @@
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Launches the data parallel training workers of one host. Arguments other than the ones below
+# are passed on to monodepth_main.py, for example on a single machine:
+#   python launch_workers.py --workers_per_host 4 --mode train --model_name my_model \
+#       --data_path ~/data/ --filenames_file ~/data/train.txt --log_directory ~/tmp/
+# On several machines, run the same command on each host with its --host_index.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Data parallel training launcher.")
+    parser.add_argument("--hosts", type = str, help = "Comma separated training hosts.", default = "localhost")
+    parser.add_argument("--host_index", type = int, help = "Index of this host in hosts.", default = 0)
+    parser.add_argument("--workers_per_host", type = int, help = "Number of workers on each host.", default = 1)
+    parser.add_argument("--base_port", type = int, help = "Port of the first worker on each host.", default = 29500)
+    return parser.parse_known_args()
+
+def launch(arguments, main_arguments):
+    hosts = arguments.hosts.split(",")
+    worker_hosts = ["{}:{}".format(host, arguments.base_port + index) for host in hosts for index in range(arguments.workers_per_host)]
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "monodepth_main.py")
+
+    workers = []
+    for index in range(arguments.workers_per_host):
+        worker_index = arguments.host_index * arguments.workers_per_host + index
+        command = [sys.executable, main_path] + main_arguments + ["--worker_hosts", ",".join(worker_hosts),
+                                                                  "--worker_index", str(worker_index)]
+        workers.append(subprocess.Popen(command))
+
+    # Stop all workers of this host once one of them fails, the others would wait on it forever.
+    try:
+        while True:
+            return_codes = [worker.poll() for worker in workers]
+            failed = [code for code in return_codes if code not in [None, 0]]
+            if failed:
+                print("A worker exited with code {}, stopping the other workers.".format(failed[0]))
+                return failed[0]
+            if all(code == 0 for code in return_codes):
+                return 0
+            time.sleep(1.0)
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+if __name__ == "__main__":
+    arguments, main_arguments = parse_args()
+    sys.exit(launch(arguments, main_arguments))
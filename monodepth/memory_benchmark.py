@@ -0,0 +1,96 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import resource
+import tensorflow as tf
+import time
+
+from monodepth_model import *
+
+# Peak training memory of the model for one configuration, on random images. On a GPU this is
+# the allocator peak, otherwise the growth of the process peak resident size over the steps.
+# Run each configuration in a separate process, for example:
+#   for size in "128 256" "256 512" "512 1024"; do
+#       set -- $size
+#       python memory_benchmark.py --input_height $1 --input_width $2
+#       python memory_benchmark.py --input_height $1 --input_width $2 --recompute
+#   done
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Training memory benchmark.")
+    parser.add_argument("--input_height", type = int, help = "Input height.", default = 256)
+    parser.add_argument("--input_width", type = int, help = "Input width.", default = 512)
+    parser.add_argument("--batch_size", type = int, help = "Batch size.", default = 4)
+    parser.add_argument("--projection", type = str, help = "Projection mode.", default = "equirectangular")
+    parser.add_argument("--precision", type = str, help = "float32 or mixed.", default = "float32")
+    parser.add_argument("--recompute", help = "Recompute activations during backpropagation.", action = "store_true")
+    parser.add_argument("--train_crop", help = "Train on the band without the polar regions.", action = "store_true")
+    parser.add_argument("--iterations", type = int, help = "Number of training steps.", default = 3)
+    return parser.parse_args()
+
+def peak_resident_bytes():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def benchmark(arguments):
+    params = monodepth_parameters(
+        height = arguments.input_height,
+        width = arguments.input_width,
+        batch_size = arguments.batch_size,
+        num_threads = 1,
+        num_epochs = 1,
+        projection = arguments.projection,
+        baseline = 0.2,
+        output_mode = "direct",
+        use_deconv = False,
+        alpha_image_loss = 0.85,
+        smoothness_loss_weight = 1.0,
+        dual_loss = False,
+        crop = False,
+        test_crop = False,
+        dropout = False,
+        noise = False,
+        tb_loss_weight = 1.0,
+        full_summary = False,
+        input_pipeline = "queue",
+        seed = None,
+        cache_path = "",
+        rectification_cache_path = "",
+        shuffle_buffer = 0,
+        uint8_buffer = False,
+        confidence_head = False,
+        precision = arguments.precision,
+        accumulate_steps = 1,
+        recompute = arguments.recompute,
+        train_crop = arguments.train_crop)
+
+    shape = [arguments.batch_size, arguments.input_height, arguments.input_width, 3]
+    top = tf.Variable(tf.random_uniform(shape), trainable = False)
+    bottom = tf.Variable(tf.random_uniform(shape), trainable = False)
+    model = MonodepthModel(params, "train", top, bottom)
+    train_op = tf.train.AdamOptimizer(1e-4).minimize(model.total_loss)
+
+    gpu = tf.test.is_gpu_available()
+    if gpu:
+        max_bytes_in_use = tf.contrib.memory_stats.MaxBytesInUse()
+
+    session = tf.Session()
+    session.run(tf.global_variables_initializer())
+    resident_bytes = peak_resident_bytes()
+
+    start = time.time()
+    for _ in range(arguments.iterations):
+        session.run(train_op)
+    step_time = (time.time() - start) / arguments.iterations
+
+    if gpu:
+        peak_bytes = session.run(max_bytes_in_use)
+    else:
+        peak_bytes = peak_resident_bytes() - resident_bytes
+    print("{}x{} batch {} {} recompute {} train crop {}: peak {:.0f} MB ({}), {:.2f} s/step".format(
+        arguments.input_height, arguments.input_width, arguments.batch_size, arguments.precision, arguments.recompute, arguments.train_crop,
+        peak_bytes / 2.0 ** 20, "allocator" if gpu else "resident growth", step_time))
+
+if __name__ == "__main__":
+    benchmark(parse_args())
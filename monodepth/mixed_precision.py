@@ -0,0 +1,57 @@
+import tensorflow as tf
+
+# Mixed precision helpers. Layers run in float16 while their variables are kept in float32,
+# so checkpoints are the same as for float32 training. Gradients are computed from a scaled
+# loss to keep small float16 gradients from flushing to zero.
+
+def float32_variable_getter(getter, name, shape = None, dtype = None, trainable = True, *args, **kwargs):
+    # Custom getter creating float32 master variables for float16 layers.
+    storage_dtype = tf.float32 if dtype == tf.float16 else dtype
+    variable = getter(name, shape, dtype = storage_dtype, trainable = trainable, *args, **kwargs)
+    if dtype == tf.float16:
+        variable = tf.cast(variable, tf.float16)
+    return variable
+
+class DynamicLossScale(object):
+    """Dynamic loss scale"""
+
+    def __init__(self, initial_scale = 2.0 ** 15, increment_period = 2000, multiplier = 2.0):
+        self.increment_period = increment_period
+        self.multiplier = multiplier
+
+        # Local variables, so that checkpoints stay compatible with float32 training.
+        with tf.variable_scope("loss_scale"):
+            self.scale = tf.get_variable("scale", initializer = float(initial_scale), trainable = False,
+                                         collections = [tf.GraphKeys.LOCAL_VARIABLES])
+            self.good_steps = tf.get_variable("good_steps", initializer = 0, trainable = False,
+                                              collections = [tf.GraphKeys.LOCAL_VARIABLES])
+
+    def scale_loss(self, loss):
+        return loss * self.scale
+
+    def unscale(self, grads_and_vars):
+        return [(None if grad is None else grad / self.scale, var) for grad, var in grads_and_vars]
+
+    def apply_gradients(self, optimizer, grads_and_vars, global_step):
+        # Steps with overflowing gradients are skipped and halve the scale, the scale grows again
+        # after increment_period finite steps. The global step always advances, so that learning
+        # rate schedules follow the training loop.
+        finite = tf.reduce_all([tf.reduce_all(tf.is_finite(grad)) for grad, _ in grads_and_vars if grad is not None])
+
+        def finite_step():
+            grow = tf.greater_equal(self.good_steps + 1, self.increment_period)
+            update_scale = tf.group(
+                self.scale.assign(tf.where(grow, self.scale * self.multiplier, self.scale)),
+                self.good_steps.assign(tf.where(grow, 0, self.good_steps + 1)))
+            # Reset the name scope, so that optimizer variables are named as without loss scaling.
+            with tf.name_scope(None):
+                apply_gradients = optimizer.apply_gradients(grads_and_vars)
+            return tf.group(apply_gradients, update_scale)
+
+        def overflow_step():
+            return tf.group(
+                self.scale.assign(tf.maximum(self.scale / self.multiplier, 1.0)),
+                self.good_steps.assign(0))
+
+        with tf.control_dependencies([tf.cond(finite, finite_step, overflow_step)]):
+            return global_step.assign_add(1)
@@ -11,121 +11,290 @@
 """Monodepth dataloader.
 """
 
+import numpy as np
+import os
 import tensorflow as tf
 
-from spherical import fast_rotate
+from rectification_cache import RectificationCache
+from shard_cache import ShardCache
 from spherical import rotate
 
 def string_length_tf(t):
     return tf.py_func(len, [t], [tf.int64])
 
+def rectify(image, rx, ry, rz):
+    tf_rx = tf.stack([tf.string_to_number(rx)])
+    tf_ry = tf.stack([tf.string_to_number(ry)])
+    tf_rz = tf.stack([tf.string_to_number(rz)])
+    rotated_image = rotate(tf.expand_dims(image, 0), tf_rx, tf_ry, tf_rz)
+    return rotated_image[0, :, :, :]
+
+def stateless_random_uniform(seed, index):
+    # Drop-in for tf.random_uniform keyed by the sample index and the number of draws so far,
+    # so that augmentations do not depend on which thread processes a sample.
+    draws = [0]
+    def random_uniform(shape, minval=0, maxval=None, dtype=tf.float32):
+        draws[0] += 1
+        key = tf.stack([index, tf.constant(seed * 1024 + draws[0], dtype=tf.int64)])
+        uniform = tf.contrib.stateless.stateless_random_uniform(shape, key)
+        if maxval is None:
+            maxval = 1
+        minval = tf.cast(minval, tf.float32)
+        maxval = tf.cast(maxval, tf.float32)
+        if dtype.is_integer:
+            return tf.cast(tf.floor(minval + uniform * (maxval - minval)), dtype)
+        return minval + uniform * (maxval - minval)
+    return random_uniform
+
 class MonodepthDataloader(object):
     """Monodepth dataloader"""
 
-    def __init__(self, data_path, filenames_file, params, mode):
+    def __init__(self, data_path, filenames_file, params, mode, num_shards=1, shard_index=0):
         self.data_path = data_path
         self.params = params
         self.mode = mode
 
+        # Data parallel workers each read a disjoint shard of the filenames.
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+
         self.top_image_batch = None
         self.bottom_image_batch = None
 
-        input_queue = tf.train.string_input_producer([filenames_file], shuffle=False)
-        line_reader = tf.TextLineReader()
-        _, line = line_reader.read(input_queue)
+        # Fill fractions of the input queues by queue name, empty for the dataset pipeline.
+        self.queue_fill_levels = {}
+
+        # Read pre-decoded images from a shard cache if given.
+        self.cache = None
+        if params.cache_path:
+            self.cache = ShardCache(params.cache_path)
+            if self.cache.shape != [params.height, params.width]:
+                raise ValueError("Shard cache resolution {} does not match input size {}.".format(
+                    self.cache.shape, [params.height, params.width]))
+
+        # Use rectified top images from an offline cache where available.
+        self.rectification_cache = None
+        if params.rectification_cache_path and mode == 'train':
+            self.rectification_cache = RectificationCache(params.rectification_cache_path, [params.height, params.width])
+
+        lines = self.read_lines(filenames_file)
+        if params.input_pipeline == 'dataset':
+            self.build_dataset(lines)
+        else:
+            self.build_queue(lines)
+
+    def read_lines(self, filenames_file):
+        with open(filenames_file, 'r') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        lines = lines[self.shard_index::self.num_shards]
+
+        if self.rectification_cache is not None:
+            # Append the cached rectified image path, or '-' if it is missing, to each line.
+            num_cached = 0
+            for index, line in enumerate(lines):
+                split_line = line.split()
+                image_path = os.path.join(self.data_path, 'top', split_line[0] + '.jpg')
+                rectified_path = self.rectification_cache.lookup(image_path, *split_line[1:4])
+                if rectified_path is None:
+                    rectified_path = '-'
+                else:
+                    num_cached += 1
+                lines[index] = ' '.join(split_line[:4] + [rectified_path])
+            self.rectification_cache.save_manifest()
+            print("Rectified images cached: {} of {}".format(num_cached, len(lines)))
+
+        return lines
+
+    def build_queue(self, lines):
+        num_queue_runners = len(tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS))
+        line = tf.train.string_input_producer(lines, shuffle=False).dequeue()
+
+        if self.mode == 'train':
+            sample = self.load_train_pair(line, tf.random_uniform)
+
+            # capacity = min_after_dequeue + (num_threads + a small safety margin) * batch_size
+            min_after_dequeue = self.params.shuffle_buffer
+            capacity = min_after_dequeue + 4 * self.params.batch_size
+            batch = tf.train.shuffle_batch(
+                list(sample),
+                self.params.batch_size, capacity, min_after_dequeue, self.params.num_threads)
+
+            if self.params.uint8_buffer:
+                batch = self.postprocess_batch(*batch)
+            self.top_image_batch, self.bottom_image_batch = batch
+
+        elif self.mode == 'test':
+            top_image = self.load_test_image(line)
+            self.top_image_batch = tf.train.batch([top_image], self.params.batch_size)
+
+        for queue_runner in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)[num_queue_runners:]:
+            queue = queue_runner.queue
+            capacity = queue.queue_ref.op.get_attr('capacity')
+            self.queue_fill_levels[queue.name] = tf.cast(queue.size(), tf.float32) / capacity
+
+    def build_dataset(self, lines):
+        # Samples are decoded, rectified and augmented by parallel map calls and batches are
+        # prefetched, so that loading overlaps with the training step. With a seed, the order
+        # and the augmentations are reproducible.
+        dataset = tf.data.Dataset.from_tensor_slices(tf.constant(lines))
+
+        if self.mode == 'train':
+            dataset = dataset.shuffle(self.params.shuffle_buffer, seed=self.params.seed).repeat()
+
+            # Number samples so that stateless augmentations can be keyed by position.
+            indices = tf.data.Dataset.range(np.iinfo(np.int64).max)
+            dataset = tf.data.Dataset.zip((indices, dataset))
+
+            def load(index, line):
+                if self.params.seed is None:
+                    random_uniform = tf.random_uniform
+                else:
+                    random_uniform = stateless_random_uniform(self.params.seed, index)
+                return self.load_train_pair(line, random_uniform)
+
+        elif self.mode == 'test':
+            dataset = dataset.repeat()
+            load = self.load_test_image
+
+        dataset = dataset.map(load, num_parallel_calls=self.params.num_threads)
+        dataset = dataset.batch(self.params.batch_size)
+        if self.mode == 'train' and self.params.uint8_buffer:
+            dataset = dataset.map(self.postprocess_batch, num_parallel_calls=self.params.num_threads)
+        dataset = dataset.prefetch(2)
+        batch = dataset.make_one_shot_iterator().get_next()
+
+        if self.mode == 'train':
+            self.top_image_batch, self.bottom_image_batch = batch
+            self.bottom_image_batch.set_shape([self.params.batch_size, self.params.height, self.params.width, 3])
+        else:
+            self.top_image_batch = batch
+        self.top_image_batch.set_shape([self.params.batch_size, self.params.height, self.params.width, 3])
 
+    def load_test_image(self, line):
         split_line = tf.string_split([line]).values
-        
-        def rectify(image, rx, ry, rz):
-            tf_rx = tf.stack([tf.string_to_number(rx)])
-            tf_ry = tf.stack([tf.string_to_number(ry)])
-            tf_rz = tf.stack([tf.string_to_number(rz)])
-            rotated_image = rotate(tf.expand_dims(image, 0), tf_rx, tf_ry, tf_rz)
-            return rotated_image[0, :, :, :]
 
         # We only load one image for testing.
-        if mode == 'test':
+        if self.cache is not None:
+            top_image_o, _ = self.read_cached_pair(split_line[0])
+        else:
             top_image_path = tf.string_join([self.data_path, '/top/', split_line[0], '.jpg'])
             top_image_o = self.read_image(top_image_path)
+        top_image_o.set_shape([self.params.height, self.params.width, 3])
+        return top_image_o
+
+    def load_train_pair(self, line, random_uniform):
+        split_line = tf.string_split([line]).values
+
+        # The top image is only read when it has to be rectified.
+        if self.cache is not None:
+            cached_top_image, bottom_image_o = self.read_cached_pair(split_line[0])
+            read_top_image = lambda: cached_top_image
         else:
             top_image_path = tf.string_join([self.data_path, '/top/', split_line[0], '.jpg'])
             bottom_image_path = tf.string_join([self.data_path, '/bottom/', split_line[0], '.jpg'])
-            top_image_o = self.read_image(top_image_path)
+            read_top_image = lambda: self.read_image(top_image_path)
             bottom_image_o = self.read_image(bottom_image_path)
 
-        if mode == 'train':
-            x, y = tf.meshgrid(tf.linspace(0.0, 1.0, self.params.width), tf.linspace(0.0, 1.0, self.params.height))
-            crop_x = tf.tile(tf.expand_dims(tf.exp(- 512.0 * (x - 0.5) ** 6.0), 2), [1, 1, 3])
-            crop_y = tf.tile(tf.expand_dims(tf.exp(- 512.0 * (y - 0.5) ** 6.0), 2), [1, 1, 3])
-            
-            top_image = rectify(top_image_o, split_line[1], split_line[2], split_line[3])
-            
-            # Randomly flip images.
-            do_h_flip = tf.random_uniform([], 0.0, 1.0)
-            top_image  = tf.cond(do_h_flip > 0.5, lambda: tf.image.flip_left_right(top_image), lambda: top_image)
-            bottom_image = tf.cond(do_h_flip > 0.5, lambda: tf.image.flip_left_right(bottom_image_o),  lambda: bottom_image_o)
-            
-            do_v_flip = tf.random_uniform([], 0.0, 1.0) > 0.5
-            top_image, bottom_image = tf.cond(do_v_flip, lambda: [tf.image.flip_up_down(bottom_image), tf.image.flip_up_down(top_image)], lambda: [top_image, bottom_image])
-            
-            # Randomly crop images.
-            if self.params.crop:
-                do_crop_x = tf.random_uniform([], 0.0, 1.0)
-                top_image, bottom_image = tf.cond(do_crop_x > 0.85, lambda: [crop_x * top_image, crop_x * bottom_image], lambda: [top_image, bottom_image])
-                
-                do_crop_y = tf.random_uniform([], 0.0, 1.0)
-                top_image, bottom_image = tf.cond(do_crop_y > 0.85, lambda: [crop_y * top_image, crop_y * bottom_image], lambda: [top_image, bottom_image])
-            
-            # Randomly rotate images.
-            limit = tf.cast(tf.shape(top_image)[1] / 2, dtype=tf.int32)
-            random_dx = tf.random_uniform([], - limit, limit, dtype=tf.int32)
-            top_image = fast_rotate(top_image, random_dx)
-            bottom_image = fast_rotate(bottom_image, random_dx)
-
-            # Randomly augment images.
-            do_augment = tf.random_uniform([], 0, 1)
-            top_image, bottom_image = tf.cond(do_augment > 0.5,
-                                                        lambda: self.augment_image_pair(top_image,
-                                                                                            bottom_image),
-                                                        lambda: (top_image, bottom_image))
+        if self.rectification_cache is None:
+            top_image = rectify(read_top_image(), split_line[1], split_line[2], split_line[3])
+        else:
+            top_image = tf.cond(tf.equal(split_line[4], '-'),
+                                lambda: rectify(read_top_image(), split_line[1], split_line[2], split_line[3]),
+                                lambda: self.read_rectified_image(split_line[4]))
+
+        # Draw the flip, swap, crop and rotation augmentations.
+        do_h_flip = random_uniform([], 0.0, 1.0) > 0.5
+        do_v_flip = random_uniform([], 0.0, 1.0) > 0.5
+        if self.params.crop:
+            do_crop_x = random_uniform([], 0.0, 1.0) > 0.85
+            do_crop_y = random_uniform([], 0.0, 1.0) > 0.85
+        limit = self.params.width // 2
+        random_dx = random_uniform([], - limit, limit, dtype=tf.int32)
+
+        # Compose the horizontal flip, the vertical swap-flip and the rotation into one
+        # index remap, so that each output image is a single gather of its source image.
+        height = self.params.height
+        width = self.params.width
+        rotated_columns = tf.mod(tf.range(width) - random_dx, width)
+        columns = tf.cond(do_h_flip, lambda: width - 1 - rotated_columns, lambda: rotated_columns)
+        rows = tf.cond(do_v_flip, lambda: tf.range(height - 1, -1, -1), lambda: tf.range(height))
+        indices = tf.expand_dims(rows, 1) * width + tf.expand_dims(columns, 0)
+
+        top_source, bottom_source = tf.cond(do_v_flip, lambda: [bottom_image_o, top_image], lambda: [top_image, bottom_image_o])
+        top_image = tf.gather(tf.reshape(top_source, [height * width, 3]), indices)
+        bottom_image = tf.gather(tf.reshape(bottom_source, [height * width, 3]), indices)
+
+        # Randomly crop images. The masks are symmetric under flips, so only the
+        # column mask has to follow the rotation.
+        crop_x = tf.ones([width])
+        crop_y = tf.ones([height])
+        if self.params.crop:
+            x = tf.linspace(0.0, 1.0, width)
+            y = tf.linspace(0.0, 1.0, height)
+            crop_x = tf.cond(do_crop_x, lambda: tf.gather(tf.exp(- 512.0 * (x - 0.5) ** 6.0), rotated_columns), lambda: crop_x)
+            crop_y = tf.cond(do_crop_y, lambda: tf.exp(- 512.0 * (y - 0.5) ** 6.0), lambda: crop_y)
+
+        if self.params.uint8_buffer:
+            # Keep the images as uint8 and only pass the crop masks and colour augmentation
+            # parameters along, postprocess_batch applies them after batching.
+            do_augment = random_uniform([], 0, 1)
+            random_augmentation = self.random_augmentation(random_uniform)
+            augmentation = tf.cond(do_augment > 0.5, lambda: random_augmentation, lambda: tf.ones([5]))
 
+            top_image = tf.image.convert_image_dtype(top_image, tf.uint8, saturate=True)
+            bottom_image = tf.image.convert_image_dtype(bottom_image, tf.uint8, saturate=True)
             top_image.set_shape([self.params.height, self.params.width, 3])
             bottom_image.set_shape([self.params.height, self.params.width, 3])
+            return top_image, bottom_image, crop_x, crop_y, augmentation
 
-            # capacity = min_after_dequeue + (num_threads + a small safety margin) * batch_size
-            min_after_dequeue = 1024
-            capacity = min_after_dequeue + 4 * params.batch_size
-            self.top_image_batch, self.bottom_image_batch = tf.train.shuffle_batch(
-                [top_image, bottom_image],
-                params.batch_size, capacity, min_after_dequeue, params.num_threads)
-
-        elif mode == 'test':
-            top_image_o.set_shape([self.params.height, self.params.width, 3])
-            self.top_image_batch = tf.train.batch([top_image_o], params.batch_size)
-
-    def augment_image_pair(self, top_image, bottom_image):
-        # Randomly shift gamma.
-        random_gamma = tf.random_uniform([], 0.8, 1.2)
-        top_image_aug = top_image ** random_gamma
-        bottom_image_aug = bottom_image ** random_gamma
-
-        # Randomly shift brightness.
-        random_brightness = tf.random_uniform([], 0.5, 2.0)
-        top_image_aug = top_image_aug * random_brightness
-        bottom_image_aug = bottom_image_aug * random_brightness
-
-        # Randomly shift color.
-        random_colors = tf.random_uniform([3], 0.8, 1.2)
-        white = tf.ones([tf.shape(bottom_image)[0], tf.shape(bottom_image)[1]])
-        color_image = tf.stack([white * random_colors[i] for i in range(3)], axis=2)
-        top_image_aug *= color_image
-        bottom_image_aug *= color_image
+        if self.params.crop:
+            crop = tf.expand_dims(tf.expand_dims(crop_y, 1) * tf.expand_dims(crop_x, 0), 2)
+            top_image, bottom_image = tf.cond(tf.logical_or(do_crop_x, do_crop_y), lambda: [crop * top_image, crop * bottom_image], lambda: [top_image, bottom_image])
+
+        # Randomly augment images.
+        do_augment = random_uniform([], 0, 1)
+        top_image, bottom_image = tf.cond(do_augment > 0.5,
+                                                    lambda: self.augment_image_pair(top_image,
+                                                                                        bottom_image,
+                                                                                        random_uniform),
+                                                    lambda: (top_image, bottom_image))
+
+        top_image.set_shape([self.params.height, self.params.width, 3])
+        bottom_image.set_shape([self.params.height, self.params.width, 3])
+        return top_image, bottom_image
+
+    def random_augmentation(self, random_uniform=tf.random_uniform):
+        # Gamma, brightness and colour shifts.
+        random_gamma = random_uniform([], 0.8, 1.2)
+        random_brightness = random_uniform([], 0.5, 2.0)
+        random_colors = random_uniform([3], 0.8, 1.2)
+        return tf.concat([tf.stack([random_gamma, random_brightness]), random_colors], 0)
+
+    def apply_augmentation(self, images, augmentation):
+        # Broadcasts [..., 5] augmentation parameters against [..., height, width, 3] images.
+        gamma = tf.expand_dims(tf.expand_dims(augmentation[..., 0:1], -2), -2)
+        brightness = tf.expand_dims(tf.expand_dims(augmentation[..., 1:2], -2), -2)
+        colors = tf.expand_dims(tf.expand_dims(augmentation[..., 2:5], -2), -2)
 
         # Saturate.
-        top_image_aug = tf.clip_by_value(top_image_aug, 0, 1)
-        bottom_image_aug = tf.clip_by_value(bottom_image_aug, 0, 1)
+        return tf.clip_by_value(images ** gamma * brightness * colors, 0, 1)
+
+    def augment_image_pair(self, top_image, bottom_image, random_uniform=tf.random_uniform):
+        augmentation = self.random_augmentation(random_uniform)
+        return self.apply_augmentation(top_image, augmentation), self.apply_augmentation(bottom_image, augmentation)
 
-        return top_image_aug, bottom_image_aug
+    def postprocess_batch(self, top_images, bottom_images, crop_x, crop_y, augmentation):
+        # Converts a batch of uint8 images to float and applies the crop masks and colour
+        # augmentation drawn in load_train_pair.
+        top_images = tf.image.convert_image_dtype(top_images, tf.float32)
+        bottom_images = tf.image.convert_image_dtype(bottom_images, tf.float32)
+
+        if self.params.crop:
+            crop = tf.expand_dims(tf.expand_dims(crop_y, 2) * tf.expand_dims(crop_x, 1), 3)
+            top_images *= crop
+            bottom_images *= crop
+
+        return self.apply_augmentation(top_images, augmentation), self.apply_augmentation(bottom_images, augmentation)
 
     def read_image(self, image_path):
         # tf.decode_image does not return the image size, this is an ugly workaround to handle both jpeg and png
@@ -140,3 +309,18 @@ class MonodepthDataloader(object):
         image = tf.image.resize_images(image, [self.params.height, self.params.width], tf.image.ResizeMethod.AREA)
 
         return image
+
+    def read_cached_pair(self, name):
+        # Slices the pair out of the memory-mapped shards, already at training resolution.
+        top_image, bottom_image = tf.py_func(self.cache.read, [name], [tf.uint8, tf.uint8], stateful=False)
+        top_image = tf.image.convert_image_dtype(top_image, tf.float32)
+        bottom_image = tf.image.convert_image_dtype(bottom_image, tf.float32)
+        top_image.set_shape([self.params.height, self.params.width, 3])
+        bottom_image.set_shape([self.params.height, self.params.width, 3])
+        return top_image, bottom_image
+
+    def read_rectified_image(self, rectified_path):
+        image = tf.py_func(lambda path: np.load(path.decode('utf-8')), [rectified_path], tf.uint8, stateful=False)
+        image = tf.image.convert_image_dtype(image, tf.float32)
+        image.set_shape([self.params.height, self.params.width, 3])
+        return image
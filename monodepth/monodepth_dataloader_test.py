@@ -0,0 +1,74 @@
+import itertools
+import numpy as np
+import os
+import shutil
+import tempfile
+import tensorflow as tf
+
+from monodepth_dataloader import *
+from monodepth_model_test import test_parameters
+from spherical import fast_rotate
+
+def reference_train_pair(top_image, bottom_image, do_h_flip, do_v_flip, do_crop_x, do_crop_y, random_dx):
+    # Flip, swap-flip, crop and rotation as separate copies, as the loader applied them before
+    # they were composed into one gather.
+    height, width = top_image.get_shape().as_list()[:2]
+    x, y = tf.meshgrid(tf.linspace(0.0, 1.0, width), tf.linspace(0.0, 1.0, height))
+    crop_x = tf.tile(tf.expand_dims(tf.exp(- 512.0 * (x - 0.5) ** 6.0), 2), [1, 1, 3])
+    crop_y = tf.tile(tf.expand_dims(tf.exp(- 512.0 * (y - 0.5) ** 6.0), 2), [1, 1, 3])
+
+    if do_h_flip:
+        top_image, bottom_image = tf.image.flip_left_right(top_image), tf.image.flip_left_right(bottom_image)
+    if do_v_flip:
+        top_image, bottom_image = tf.image.flip_up_down(bottom_image), tf.image.flip_up_down(top_image)
+    if do_crop_x:
+        top_image, bottom_image = crop_x * top_image, crop_x * bottom_image
+    if do_crop_y:
+        top_image, bottom_image = crop_y * top_image, crop_y * bottom_image
+    return fast_rotate(top_image, random_dx), fast_rotate(bottom_image, random_dx)
+
+def scripted_random_uniform(values):
+    # Returns the given draws in order, in place of tf.random_uniform, then ones for the colour
+    # augmentation parameters of the branch that is not taken.
+    values = list(values)
+    def random_uniform(shape, minval=0, maxval=None, dtype=tf.float32):
+        return tf.constant(values.pop(0) if values else 1, dtype, shape)
+    return random_uniform
+
+def train_pair_test():
+    # Compare the composed flip, swap-flip, crop and rotation remap of load_train_pair with the
+    # separate operations it replaced, for fixed draws of each augmentation.
+    data_path = tempfile.mkdtemp()
+    try:
+        params = test_parameters(height = 32, width = 64, crop = True)
+        session = tf.Session()
+        for folder in ["top", "bottom"]:
+            os.makedirs(os.path.join(data_path, folder))
+            image = np.random.randint(0, 256, [32, 64, 3]).astype(np.uint8)
+            with open(os.path.join(data_path, folder, "sample.jpg"), "wb") as image_file:
+                image_file.write(session.run(tf.image.encode_jpeg(tf.constant(image))))
+        filenames_file = os.path.join(data_path, "filenames.txt")
+        with open(filenames_file, "w") as f:
+            f.write("sample 0 0 0\n")
+
+        dataloader = MonodepthDataloader(data_path + "/", filenames_file, params, "train")
+        top_image = rectify(dataloader.read_image(tf.constant(data_path + "/top/sample.jpg")), "0", "0", "0")
+        bottom_image = dataloader.read_image(tf.constant(data_path + "/bottom/sample.jpg"))
+
+        max_error = 0.0
+        for do_h_flip, do_v_flip, do_crop_x, do_crop_y, random_dx in itertools.product(
+                [False, True], [False, True], [False, True], [False, True], [-20, 0, 13]):
+            # Draws in load_train_pair order, the last one skips the colour augmentation.
+            draws = [0.7 if do_h_flip else 0.3, 0.7 if do_v_flip else 0.3,
+                     0.9 if do_crop_x else 0.5, 0.9 if do_crop_y else 0.5, random_dx, 0.0]
+            composed = dataloader.load_train_pair(tf.constant("sample 0 0 0"), scripted_random_uniform(draws))
+            reference = reference_train_pair(top_image, bottom_image, do_h_flip, do_v_flip, do_crop_x, do_crop_y, random_dx)
+            composed_data, reference_data = session.run([composed, reference])
+            max_error = max(max_error, np.abs(np.array(composed_data) - np.array(reference_data)).max())
+        print("train_pair: max error {:.3e}".format(max_error))
+        assert max_error < 1e-6
+    finally:
+        shutil.rmtree(data_path)
+
+if __name__ == "__main__":
+    train_pair_test()
@@ -19,12 +19,17 @@ import tensorflow as tf
 import tensorflow.contrib.slim as slim
 import time
 
+from allreduce import RingAllreduce
 from average_gradients import *
+from gradient_accumulation import GradientAccumulator
 from image_utils import *
+from instrumentation import *
+from mixed_precision import DynamicLossScale
 from monodepth_model import *
 from monodepth_dataloader import *
 from spherical import equirectangular_to_pc
 from spherical import perpendicular_to_distance
+from writer_pool import WriterPool
 
 parser = argparse.ArgumentParser(description='Monodepth TensorFlow implementation.')
 
@@ -37,7 +42,7 @@ parser.add_argument('--input_width',               type=int,   help='Input width
 parser.add_argument('--batch_size',                type=int,   help='Batch size', default=8)
 parser.add_argument('--num_epochs',                type=int,   help='Number of epochs', default=30)
 parser.add_argument('--learning_rate',             type=float, help='Initial learning rate', default=5e-5)
-parser.add_argument('--projection',                type=str,   help='Projection mode - rectilinear or equirectangular', default='equirectangular')
+parser.add_argument('--projection',                type=str,   help='Projection mode - rectilinear, cubic (cube padded faces) or equirectangular', default='equirectangular')
 parser.add_argument('--baseline',                  type=float, help='Baseline distance between cameras.', default=0.2)
 parser.add_argument('--output_mode',               type=str,   help='Disparity estimation mode: direct or indirect or attenuate', default='direct')
 parser.add_argument('--tb_loss_weight',            type=float, help='Top-bottom consistency weight', default=1.0)
@@ -46,15 +51,36 @@ parser.add_argument('--smoothness_loss_weight',    type=float, help='Smoothness
 parser.add_argument('--dual_loss',                             help='Depth and disparity losses.', action='store_true')
 parser.add_argument('--crop',                                  help='Random crops.', action='store_true')
 parser.add_argument('--test_crop',                             help='Test time cropping.', action='store_true')
+parser.add_argument('--train_crop',                            help='Train on the equirectangular band without the polar regions.', action='store_true')
 parser.add_argument('--dropout',                               help='Test time dropout for confidence maps.', action='store_true')
 parser.add_argument('--noise',                                 help='Random augmentation noise for confidence.', action='store_true')
+parser.add_argument('--confidence_head',                       help='Learned confidence maps from a single pass, trained with a heteroscedastic image loss.', action='store_true')
 parser.add_argument('--use_deconv',                            help='If set, will use transposed convolutions', action='store_true')
+parser.add_argument('--precision',                 type=str,   help='Network precision - float32, or mixed for float16 layers with dynamic loss scaling', default='float32')
+parser.add_argument('--accumulate_steps',          type=int,   help='Number of batches to accumulate gradients over before each update', default=1)
+parser.add_argument('--recompute',                             help='If set, recomputes encoder and decoder activations during backpropagation to save memory', action='store_true')
+parser.add_argument('--worker_hosts',              type=str,   help='Comma separated host:port of data parallel training workers, single process if empty', default='')
+parser.add_argument('--worker_index',              type=int,   help='Index of this worker in worker_hosts', default=0)
 parser.add_argument('--gpus',                      type=str,   help='GPU indices to train on', default='0')
 parser.add_argument('--num_threads',               type=int,   help='Number of threads to use for data loading', default=8)
+parser.add_argument('--input_pipeline',            type=str,   help='Input pipeline - queue or dataset', default='queue')
+parser.add_argument('--seed',                      type=int,   help='Random seed, makes the dataset input pipeline deterministic', default=None)
+parser.add_argument('--cache_path',                type=str,   help='Path to a shard cache built with shard_cache.py, read instead of decoding images', default='')
+parser.add_argument('--rectification_cache_path',  type=str,   help='Path to a rectification cache built with rectification_cache.py', default='')
+parser.add_argument('--shuffle_buffer',            type=int,   help='Number of samples in the shuffle buffer', default=1024)
+parser.add_argument('--uint8_buffer',                          help='If set, keeps uint8 images in the shuffle buffer and converts and augments them after batching', action='store_true')
+parser.add_argument('--num_writers',               type=int,   help='Number of background threads writing test outputs, 0 writes on the main thread', default=4)
+parser.add_argument('--outputs',                   type=str,   help='Comma separated test outputs - raw_depth, depth_vis, disparity, input, bottom_est, confidence and pc', default='raw_depth,depth_vis,disparity,input,bottom_est,confidence,pc')
+parser.add_argument('--depth_format',              type=str,   help='Raw test depth format - npy, npy_float16, png16, or memmap for a single depth.npy per run', default='npy')
+parser.add_argument('--depth_png_scale',           type=float, help='Scale of depths stored as png16, 1000 stores millimetres', default=1000.0)
+parser.add_argument('--metrics_file',              type=str,   help='JSON-lines file to append stage timings and queue fill levels to, none if empty', default='')
+parser.add_argument('--trace_every',               type=int,   help='Writes a Chrome trace of every n-th step to a traces folder, 0 disables traces', default=0)
 parser.add_argument('--output_directory',          type=str,   help='Output directory for test disparities, if empty outputs to checkpoint folder', default='')
 parser.add_argument('--log_directory',             type=str,   help='Directory to save checkpoints and summaries', default='')
 parser.add_argument('--checkpoint_path',           type=str,   help='Path to a specific checkpoint to load', default='')
 parser.add_argument('--retrain',                               help='If used with checkpoint_path, will restart training from step zero', action='store_true')
+parser.add_argument('--scalar_summary_every',      type=int,   help='Number of steps between scalar summaries, 0 disables them', default=100)
+parser.add_argument('--image_summary_every',       type=int,   help='Number of steps between image summaries, 0 disables them', default=100)
 parser.add_argument('--full_summary',                          help='If set, will keep more data for each summary. Warning: the file can become very large', action='store_true')
 
 args = parser.parse_args()
@@ -79,12 +105,22 @@ def train(params):
 
     with tf.Graph().as_default(), tf.device('/cpu:0'):
 
+        if params.seed is not None:
+            tf.set_random_seed(params.seed)
+
         global_step = tf.Variable(0, trainable=False)
 
+        # Data parallel workers each train on a shard of the data, and average their gradients
+        # before every update. The first worker writes summaries and checkpoints.
+        worker_hosts = args.worker_hosts.split(',') if args.worker_hosts else []
+        num_workers = max(len(worker_hosts), 1)
+        chief = args.worker_index == 0
+
         # OPTIMIZER
         num_training_samples = count_text_lines(args.filenames_file)
         
-        steps_per_epoch = np.ceil(num_training_samples / params.batch_size).astype(np.int32)
+        # Steps count optimizer updates, each of which takes accumulate_steps batches on every worker.
+        steps_per_epoch = np.ceil(num_training_samples / (params.batch_size * params.accumulate_steps * num_workers)).astype(np.int32)
         num_total_steps = params.num_epochs * steps_per_epoch
 
         boundaries = [np.int32((3/5) * num_total_steps), np.int32((4/5) * num_total_steps)]
@@ -93,10 +129,13 @@ def train(params):
         
         opt_step = tf.train.AdamOptimizer(learning_rate)
 
+        if params.precision == 'mixed':
+            loss_scale = DynamicLossScale()
+
         print("Total number of samples: {}".format(num_training_samples))
         print("Total number of steps: {}".format(num_total_steps))
 
-        dataloader = MonodepthDataloader(args.data_path, args.filenames_file, params, args.mode)
+        dataloader = MonodepthDataloader(args.data_path, args.filenames_file, params, args.mode, num_workers, args.worker_index)
         top  = dataloader.top_image_batch
         bottom = dataloader.bottom_image_batch
 
@@ -118,19 +157,41 @@ def train(params):
 
                     reuse_variables = True
 
-                    grads = opt_step.compute_gradients(loss)
+                    if params.precision == 'mixed':
+                        grads = loss_scale.unscale(opt_step.compute_gradients(loss_scale.scale_loss(loss)))
+                    else:
+                        grads = opt_step.compute_gradients(loss)
 
                     tower_grads.append(grads)
 
         grads = average_gradients(tower_grads)
 
-        apply_gradient_op = opt_step.apply_gradients(grads, global_step=global_step)
+        if params.accumulate_steps > 1:
+            accumulator = GradientAccumulator(grads, params.accumulate_steps)
+            grads = accumulator.average_gradients()
+
+        if num_workers > 1:
+            # Gradients are averaged over the workers outside of the graph, and fed to the update.
+            worker_grads = [grad for grad, _ in grads if grad is not None]
+            averaged_grads = [tf.placeholder(grad.dtype, grad.get_shape()) for grad in worker_grads]
+            averaged_grads_iter = iter(averaged_grads)
+            grads = [(None if grad is None else next(averaged_grads_iter), var) for grad, var in grads]
+
+        if params.precision == 'mixed':
+            apply_gradient_op = loss_scale.apply_gradients(opt_step, grads, global_step)
+            tf.summary.scalar('loss_scale', loss_scale.scale, ['model_0'])
+        else:
+            apply_gradient_op = opt_step.apply_gradients(grads, global_step=global_step)
+
+        if params.accumulate_steps > 1:
+            apply_gradient_op = accumulator.reset_after(apply_gradient_op)
 
         total_loss = tf.reduce_mean(tower_losses)
         
         tf.summary.scalar('learning_rate', learning_rate, ['model_0'])
         tf.summary.scalar('total_loss', total_loss, ['model_0'])
-        summary_op = tf.summary.merge_all('model_0')
+        scalar_summary_op = tf.summary.merge_all('model_0')
+        image_summary_op = tf.summary.merge_all('model_0_images')
 
         # SESSION
         config = tf.ConfigProto(allow_soft_placement=True)
@@ -138,7 +199,8 @@ def train(params):
         session = tf.Session(config=config)
 
         # SAVER
-        summary_writer = tf.summary.FileWriter(args.log_directory + '/' + args.model_name, session.graph)
+        if chief:
+            summary_writer = tf.summary.FileWriter(args.log_directory + '/' + args.model_name, session.graph)
         train_saver = tf.train.Saver()
 
         # COUNT PARAMS 
@@ -160,25 +222,83 @@ def train(params):
             if args.retrain:
                 session.run(global_step.assign(0))
 
+        # Start all workers from the variables of the first worker, one variable at a time to limit memory use.
+        if num_workers > 1:
+            ring = RingAllreduce(worker_hosts, args.worker_index)
+            for variable in tf.global_variables():
+                variable.load(ring.broadcast([session.run(variable)])[0], session)
+
+        # INSTRUMENTATION
+        stage_timer = StageTimer()
+        queue_sampler = QueueSampler(dataloader.queue_fill_levels)
+        step_tracer = StepTracer(args.log_directory + '/' + args.model_name + '/traces', args.trace_every)
+        metrics_log = MetricsLog(args.metrics_file if chief else '')
+
         # GO!
         start_step = global_step.eval(session=session)
         start_time = time.time()
         for step in range(start_step, num_total_steps):
             before_op_time = time.time()
-            _, loss_value = session.run([apply_gradient_op, total_loss])
+            loss_values = []
+            for _ in range(params.accumulate_steps - 1):
+                with stage_timer.time('accumulate'):
+                    loss_values.append(session.run([accumulator.accumulate_op, total_loss])[1])
+            # Summaries are fetched with the update, so that they come from the same batch as the loss.
+            summary_ops = []
+            if chief and step and args.scalar_summary_every and step % args.scalar_summary_every == 0:
+                summary_ops.append(scalar_summary_op)
+            if chief and step and args.image_summary_every and step % args.image_summary_every == 0:
+                summary_ops.append(image_summary_op)
+            if num_workers > 1:
+                fetches = [worker_grads, total_loss, queue_sampler.fetches, summary_ops]
+            else:
+                fetches = [apply_gradient_op, total_loss, queue_sampler.fetches, summary_ops]
+            if step_tracer.should_trace(step):
+                # Traced steps are slower, so they are timed separately.
+                with stage_timer.time('traced_step'):
+                    (step_result, loss_value, queue_fill_levels, summary_strs), input_wait = step_tracer.run(session, fetches, step)
+                stage_timer.add('input_wait', input_wait)
+            else:
+                with stage_timer.time('summary_step' if summary_ops else 'step'):
+                    step_result, loss_value, queue_fill_levels, summary_strs = session.run(fetches)
+            queue_sampler.add(queue_fill_levels)
+            if num_workers > 1:
+                # Every worker applies the same averaged gradients, so that variables and global steps
+                # stay equal. The allreduce also keeps the workers in lock-step.
+                with stage_timer.time('allreduce'):
+                    averages = ring.allreduce(step_result + [np.mean(loss_values + [loss_value])])
+                with stage_timer.time('update'):
+                    session.run(apply_gradient_op, dict(zip(averaged_grads, averages[:-1])))
+                loss_values, loss_value = [], averages[-1]
+            if summary_strs:
+                with stage_timer.time('summary'):
+                    for summary_str in summary_strs:
+                        summary_writer.add_summary(summary_str, global_step=step)
+            loss_value = np.mean(loss_values + [loss_value])
             duration = time.time() - before_op_time
             if step and step % 100 == 0:
-                examples_per_sec = params.batch_size / duration
+                examples_per_sec = params.batch_size * params.accumulate_steps * num_workers / duration
                 time_sofar = (time.time() - start_time) / 3600
                 training_time_left = (num_total_steps / step - 1.0) * time_sofar
                 print_string = 'Batch {:>6} | Examples/s: {:4.2f} | Loss: {:.5f} | Time elapsed: {:.2f}h | Time left: {:.2f}h'
                 print(print_string.format(step, examples_per_sec, loss_value, time_sofar, training_time_left))
-                summary_str = session.run(summary_op)
-                summary_writer.add_summary(summary_str, global_step=step)
-            if step and step % 10000 == 0:
-                train_saver.save(session, args.log_directory + '/' + args.model_name + '/model', global_step=step)
 
-        train_saver.save(session, args.log_directory + '/' + args.model_name + '/model', global_step=num_total_steps)
+                stages = stage_timer.summary()
+                queues = queue_sampler.summary()
+                print(format_stages(stages, queues))
+                metrics_log.write(mode='train', step=int(step), examples_per_sec=examples_per_sec, loss=float(loss_value),
+                                  stages=stages, queues=queues)
+                stage_timer.reset()
+                queue_sampler.reset()
+            if chief and step and step % 10000 == 0:
+                with stage_timer.time('checkpoint'):
+                    train_saver.save(session, args.log_directory + '/' + args.model_name + '/model', global_step=step)
+
+        if chief:
+            train_saver.save(session, args.log_directory + '/' + args.model_name + '/model', global_step=num_total_steps)
+        metrics_log.close()
+        if num_workers > 1:
+            ring.close()
 
 def test(params):
     """Test function."""
@@ -190,16 +310,36 @@ def test(params):
     model = MonodepthModel(params, args.mode, top, bottom)
 
     # OUTPUTS
+    # Only the selected outputs are fetched, keyed by the file name suffix they are written to.
+    outputs = args.outputs.split(',')
     tf_raw_depth_batch = perpendicular_to_distance(model.depth_top_est[0])
-    tf_depth_top_batch = encode_images(normalize_depth(tf_raw_depth_batch), params.batch_size)
-    tf_depth_bottom_batch = encode_images(normalize_depth(perpendicular_to_distance(model.depth_bottom_est[0])), params.batch_size)
-    tf_disparity_top_batch = encode_images(normalize_disparity(model.disparity_top_est[0]), params.batch_size)
-    if params.dropout or params.noise:
-        tf_confidence_top_batch = encode_images(normalize(tf.expand_dims(model.confidence1[:, :, :, 0], 3)), params.batch_size)
-        tf_confidence_bottom_batch = encode_images(normalize(tf.expand_dims(model.confidence1[:, :, :, 1], 3)), params.batch_size)
-    tf_top_batch = encode_images(model.top, params.batch_size)
-    tf_bottom_est_batch = encode_images(model.bottom_est[0], params.batch_size)
-    tf_pc_batch = equirectangular_to_pc(model.top, model.depth_top_est[0])
+    tf_outputs = {}
+    if 'raw_depth' in outputs:
+        if args.depth_format == 'png16':
+            tf_outputs['depth.png'] = encode_depth_png(tf_raw_depth_batch, args.depth_png_scale)
+        elif args.depth_format == 'npy_float16':
+            tf_outputs['depth.npy'] = tf.cast(tf.squeeze(tf_raw_depth_batch, 3), tf.float16)
+        else:
+            tf_outputs['depth.npy'] = tf.squeeze(tf_raw_depth_batch, 3)
+    if 'depth_vis' in outputs:
+        tf_outputs['depth_top.jpg'] = encode_batch(normalize_depth(tf_raw_depth_batch))
+        tf_outputs['depth_bottom.jpg'] = encode_batch(normalize_depth(perpendicular_to_distance(model.depth_bottom_est[0])))
+    if 'disparity' in outputs:
+        tf_outputs['disparity_top.jpg'] = encode_batch(normalize_disparity(model.disparity_top_est[0]))
+    if 'input' in outputs:
+        tf_outputs['top.jpg'] = encode_batch(model.top)
+    if 'bottom_est' in outputs:
+        tf_outputs['bottom_est.jpg'] = encode_batch(model.bottom_est[0])
+    if 'confidence' in outputs and (params.dropout or params.noise or params.confidence_head):
+        tf_outputs['confidence_top.jpg'] = encode_batch(normalize(tf.expand_dims(model.confidence1[:, :, :, 0], 3)))
+        tf_outputs['confidence_bottom.jpg'] = encode_batch(normalize(tf.expand_dims(model.confidence1[:, :, :, 1], 3)))
+
+    tf_batch_size = tf.shape(top)[0]
+
+    # Point clouds are only fetched for some batches.
+    tf_pc_outputs = {}
+    if 'pc' in outputs:
+        tf_pc_outputs['pc.xyz'] = equirectangular_to_pc(model.top, model.depth_top_est[0])
 
     # SESSION
     config = tf.ConfigProto(allow_soft_placement=True)
@@ -227,75 +367,90 @@ def test(params):
     print("Testing {} files".format(num_test_samples))
 
     image_index = 0
-    rate = None
+    rate = 0.0
     if num_test_samples < 300:
         pc_step = params.batch_size
     elif num_test_samples < 1000:
         pc_step = params.batch_size * 10
     else:
         pc_step = params.batch_size * 40
-    
-    for index in range(iterations):
-        print("Processing image {}, current rate: {:.2f} fps".format(image_index, rate))
 
-        start = time.time()
+    # All raw depths of the run in a single array file, written in place.
+    depth_memmap = None
+    if 'depth.npy' in tf_outputs and args.depth_format == 'memmap':
+        depth_memmap = np.lib.format.open_memmap(os.path.join(args.output_directory, "depth.npy"), mode="w+", dtype=np.float32,
+                                                 shape=(num_test_samples, params.height, params.width))
+
+    def write_outputs(image_index, sample):
+        for suffix, value in sample.items():
+            filename = os.path.join(args.output_directory, "{}_{}".format(image_index, suffix))
+            if suffix == 'depth.npy' and depth_memmap is not None:
+                depth_memmap[image_index] = value
+            elif suffix.endswith('.npy'):
+                np.save(filename, value)
+            elif suffix.endswith('.xyz'):
+                write_pc(value, filename)
+            else:
+                write_image(value, filename)
+
+    # INSTRUMENTATION
+    stage_timer = StageTimer()
+    queue_sampler = QueueSampler(dataloader.queue_fill_levels)
+    step_tracer = StepTracer(os.path.join(args.output_directory, 'traces'), args.trace_every)
+    metrics_log = MetricsLog(args.metrics_file)
+
+    def report():
+        stages = stage_timer.summary()
+        queues = queue_sampler.summary()
+        print(format_stages(stages, queues))
+        metrics_log.write(mode='test', images=image_index, rate=rate, stages=stages, queues=queues)
+        stage_timer.reset()
+        queue_sampler.reset()
+
+    # Outputs are written in the background while the next batch runs, at most two batches are pending.
+    writer_pool = WriterPool(args.num_writers, 2 * params.batch_size)
+    try:
+        for index in range(iterations):
+            print("Processing image {}, current rate: {:.2f} fps".format(image_index, rate))
+
+            start = time.time()
 
-        tf_inputs = [tf_raw_depth_batch,
-                tf_depth_top_batch,
-                tf_depth_bottom_batch,
-                tf_disparity_top_batch,
-                tf_top_batch,
-                tf_bottom_est_batch]
-
-        if image_index % pc_step == 0:
-            tf_inputs.append(tf_pc_batch)
-
-        if params.dropout:
-            tf_inputs.extend([tf_confidence_top_batch, tf_confidence_bottom_batch])
-
-        outputs = session.run(tf_inputs)
-        raw_depth_batch, depth_top_batch, depth_bottom_batch, disparity_top_batch, top_batch, bottom_est_batch = outputs[:6]
-
-        if image_index % pc_step == 0:
-            pc_batch = outputs[6]
-
-        if params.dropout:
-            confidence_top_batch, confidence_bottom_batch = outputs[(6 + int(image_index % pc_step == 0)):]
-
-        if rate is None:
-            rate = params.batch_size / (time.time() - start)
-        else:
-            rate = 0.9 * params.batch_size / (time.time() - start) + 0.1 * rate
-        for batch_index in range(min(params.batch_size, num_test_samples - image_index)):
-            # Write raw predicted depth to file.
-            np.save(os.path.join(args.output_directory, "{}_depth.npy".format(image_index)),
-                    np.squeeze(raw_depth_batch[batch_index, :, :, :]))
-
-            # Write encoded images to files.
-            write_image(depth_top_batch[batch_index],
-                        os.path.join(args.output_directory, "{}_depth_top.jpg".format(image_index)))
-            write_image(depth_bottom_batch[batch_index],
-                        os.path.join(args.output_directory, "{}_depth_bottom.jpg".format(image_index)))
-            write_image(disparity_top_batch[batch_index],
-                        os.path.join(args.output_directory, "{}_disparity_top.jpg".format(image_index)))
-            write_image(top_batch[batch_index],
-                        os.path.join(args.output_directory, "{}_top.jpg".format(image_index)))
-            write_image(bottom_est_batch[batch_index],
-                        os.path.join(args.output_directory, "{}_bottom_est.jpg".format(image_index)))
-
-            # Write point cloud to file.
             if image_index % pc_step == 0:
-                write_pc(pc_batch[batch_index],
-                         os.path.join(args.output_directory, "{}_pc.xyz".format(image_index)))
-
-            if params.dropout:
-                write_image(confidence_top_batch[batch_index],
-                            os.path.join(args.output_directory, "{}_confidence_top.jpg".format(image_index)))
-
-                write_image(confidence_bottom_batch[batch_index],
-                            os.path.join(args.output_directory, "{}_confidence_bottom.jpg".format(image_index)))
-
-            image_index += 1
+                fetches = dict(tf_outputs, **tf_pc_outputs)
+            else:
+                fetches = tf_outputs
+            # Also fetch the batch size, so that a batch is dequeued even without selected outputs.
+            fetches = [fetches, tf_batch_size, queue_sampler.fetches]
+            if step_tracer.should_trace(index):
+                with stage_timer.time('traced_step'):
+                    (batch, _, queue_fill_levels), input_wait = step_tracer.run(session, fetches, index)
+                stage_timer.add('input_wait', input_wait)
+            else:
+                with stage_timer.time('step'):
+                    batch, _, queue_fill_levels = session.run(fetches)
+            queue_sampler.add(queue_fill_levels)
+
+            # Time blocked on the writers when they fall behind.
+            with stage_timer.time('write_wait'):
+                for batch_index in range(min(params.batch_size, num_test_samples - image_index)):
+                    writer_pool.submit(write_outputs, image_index, dict((suffix, values[batch_index]) for suffix, values in batch.items()))
+                    image_index += 1
+
+            # Rate of the whole loop, including any wait for the writers.
+            if index == 0:
+                rate = params.batch_size / (time.time() - start)
+            else:
+                rate = 0.9 * params.batch_size / (time.time() - start) + 0.1 * rate
+
+            if index and index % 100 == 0:
+                report()
+    finally:
+        with stage_timer.time('flush'):
+            writer_pool.close()
+            if depth_memmap is not None:
+                depth_memmap.flush()
+    report()
+    metrics_log.close()
 
 def main(_):
 
@@ -317,7 +472,41 @@ def main(_):
         dropout=args.dropout,
         noise=args.noise,
         tb_loss_weight=args.tb_loss_weight,
-        full_summary=args.full_summary)
+        full_summary=args.full_summary,
+        input_pipeline=args.input_pipeline,
+        seed=args.seed,
+        cache_path=args.cache_path,
+        rectification_cache_path=args.rectification_cache_path,
+        shuffle_buffer=args.shuffle_buffer,
+        uint8_buffer=args.uint8_buffer,
+        confidence_head=args.confidence_head,
+        precision=args.precision,
+        accumulate_steps=args.accumulate_steps,
+        recompute=args.recompute,
+        train_crop=args.train_crop)
+
+    if args.confidence_head and (args.dropout or args.noise):
+        parser.error('--confidence_head replaces --dropout and --noise confidence maps.')
+    if args.precision not in ['float32', 'mixed']:
+        parser.error('--precision must be float32 or mixed.')
+    if not set(args.outputs.split(',')) <= set(['raw_depth', 'depth_vis', 'disparity', 'input', 'bottom_est', 'confidence', 'pc']):
+        parser.error('--outputs must be a comma separated list of raw_depth, depth_vis, disparity, input, bottom_est, confidence and pc.')
+    if args.depth_format not in ['npy', 'npy_float16', 'png16', 'memmap']:
+        parser.error('--depth_format must be npy, npy_float16, png16 or memmap.')
+    if args.scalar_summary_every < 0 or args.image_summary_every < 0:
+        parser.error('--scalar_summary_every and --image_summary_every must not be negative.')
+    if args.num_writers < 0:
+        parser.error('--num_writers must not be negative.')
+    if args.accumulate_steps < 1:
+        parser.error('--accumulate_steps must be at least 1.')
+    if args.worker_hosts and not 0 <= args.worker_index < len(args.worker_hosts.split(',')):
+        parser.error('--worker_index must index a host in --worker_hosts.')
+    if args.projection == 'cubic' and args.input_height % 256 != 0:
+        parser.error('--projection cubic needs an --input_height divisible by 256, as the encoder halves the cube faces of a quarter of the height six times.')
+    if args.train_crop and args.projection != 'equirectangular':
+        parser.error('--train_crop requires the equirectangular projection.')
+    if (args.train_crop or args.test_crop) and (args.input_height - 2 * (args.input_height // 8)) % 64 != 0:
+        parser.error('--train_crop and --test_crop need a cropped input height divisible by 64.')
 
     if args.mode == 'train':
         train(params)
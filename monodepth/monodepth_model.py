@@ -22,6 +22,8 @@ from bilinear_sampler import *
 from collections import namedtuple
 from image_utils import normalize_depth
 from image_utils import restore
+from mixed_precision import float32_variable_getter
+from recompute import recompute_grad
 from spherical import *
 
 monodepth_parameters = namedtuple('parameters',
@@ -41,7 +43,25 @@ monodepth_parameters = namedtuple('parameters',
                         'dropout, '
                         'noise, '
                         'tb_loss_weight, '
-                        'full_summary')
+                        'full_summary, '
+                        'input_pipeline, '
+                        'seed, '
+                        'cache_path, '
+                        'rectification_cache_path, '
+                        'shuffle_buffer, '
+                        'uint8_buffer, '
+                        'confidence_head, '
+                        'precision, '
+                        'accumulate_steps, '
+                        'recompute, '
+                        'train_crop')
+
+def tile_samples(x, samples, groups = 1):
+    # Repeats a [groups * batch] tensor to [groups * samples * batch], keeping the groups outermost.
+    # Cube padding expects the faces to be the outermost groups of the batch.
+    shape = [dim if dim is not None else tf.shape(x)[index + 1] for index, dim in enumerate(x.get_shape().as_list()[1:])]
+    x = tf.tile(tf.expand_dims(tf.reshape(x, [groups, -1] + shape), 1), [1, samples, 1] + [1] * len(shape))
+    return tf.reshape(x, [-1] + shape)
 
 class MonodepthModel(object):
     """Monodepth model"""
@@ -52,15 +72,26 @@ class MonodepthModel(object):
         self.top = top
         self.bottom = bottom
         self.model_collection = ['model_' + str(model_index)]
+        # Image summaries are kept apart from scalars, so that they can be written less often.
+        self.image_collection = ['model_' + str(model_index) + '_images']
 
         self.reuse_variables = reuse_variables
 
-        if self.params.projection == 'rectilinear':
+        # Inference only consumes the finest scale, the coarser ones are only used by the losses.
+        if self.mode == 'train':
+            self.num_scales = 4
+        else:
+            self.num_scales = 1
+
+        # Training on the band about the equator only, the polar rows are cropped from the losses.
+        self.train_crop = self.params.train_crop and self.mode == 'train'
+
+        if self.params.projection == 'rectilinear' or self.params.projection == 'cubic':
             self.rectilinear_net()
         elif self.params.projection == 'equirectangular':
             self.equirectangular_net()
         else:
-            print("Projection {} did not match either rectilinear or equirectangular. Defaulting to equirectangular.".format(self.params.projection))
+            print("Projection {} did not match either rectilinear, cubic or equirectangular. Defaulting to equirectangular.".format(self.params.projection))
             self.equirectangular_net()
 
         self.build_depths_and_disparities()
@@ -80,10 +111,18 @@ class MonodepthModel(object):
         gy = img[:,:-1,:,:] - img[:,1:,:,:]
         return gy
 
+    def latitude_band(self, x, scale):
+        # Rows of the training band at the given scale, all rows without a training crop.
+        if not self.train_crop:
+            return x
+        crop_height = self.params.height // 8 // 2 ** scale
+        return x[:, crop_height:-crop_height, :, :]
+
     def upsample_nn(self, x, ratio):
+        # Keep static shapes where known, so that cached projection maps can be used downstream.
         s = tf.shape(x)
-        h = s[1]
-        w = s[2]
+        h = x.get_shape()[1].value or s[1]
+        w = x.get_shape()[2].value or s[2]
         return tf.image.resize_nearest_neighbor(x, [h * ratio, w * ratio])
 
     def scale_pyramid(self, img, num_scales):
@@ -104,32 +143,28 @@ class MonodepthModel(object):
         w = shape[1]
         for i in range(num_scales - 1):
             ratio = 2 ** (i + 1)
-            nh = h / ratio
-            nw = w / ratio
+            nh = h // ratio
+            nw = w // ratio
             shapes.append([nh, nw])
-        return tf.cast(shapes, tf.int32)
+        return shapes
     
-    def expand_grids(self, S, T, batch_size):
-        S_grids = tf.expand_dims(tf.tile(tf.expand_dims(S, 0), [batch_size, 1, 1]), 3)
-        T_grids = tf.expand_dims(tf.tile(tf.expand_dims(T, 0), [batch_size, 1, 1]), 3)
-        return S_grids, T_grids
-
     def attenuate_rectilinear(self, K, disparity, position):
-        S, T = lat_long_grid([tf.shape(disparity)[1], tf.shape(disparity)[2]])
-        _, T_grids = self.expand_grids(S, -T, tf.shape(disparity)[0])
+        # Latitudes measured downwards, broadcast along batch and width.
+        T, tan_T, _, _ = latitude_tables(disparity)
+        T, tan_T = -T, -tan_T
         if position == "top":
-            attenuated_disparity = (1.0 / np.pi) * (tf.atan(disparity / K[1] + tf.tan(T_grids)) - T_grids)
+            attenuated_disparity = (1.0 / np.pi) * (tf.atan(disparity / K[1] + tan_T) - T)
         else:
-            attenuated_disparity = (1.0 / np.pi) * (T_grids - tf.atan(tf.tan(T_grids) - disparity / K[1]))
+            attenuated_disparity = (1.0 / np.pi) * (T - tf.atan(tan_T - disparity / K[1]))
         return tf.clip_by_value(tf.where(tf.is_finite(attenuated_disparity), attenuated_disparity, tf.zeros_like(attenuated_disparity)), 1e-6, 0.75)
     
     def attenuate_equirectangular(self, disparity, position):
-        S, T = lat_long_grid([tf.shape(disparity)[1], tf.shape(disparity)[2]])
-        _, T_grids = self.expand_grids(S, -T, tf.shape(disparity)[0])
+        T, tan_T, _, _ = latitude_tables(disparity)
+        T, tan_T = -T, -tan_T
         if position == "top":
-            attenuated_disparity = (1.0 / np.pi) * (tf.atan(tf.tan(np.pi * disparity) + tf.tan(T_grids)) - T_grids)
+            attenuated_disparity = (1.0 / np.pi) * (tf.atan(tf.tan(np.pi * disparity) + tan_T) - T)
         else:
-            attenuated_disparity = (1.0 / np.pi) * (T_grids - tf.atan(tf.tan(T_grids) - tf.tan(np.pi * disparity)))
+            attenuated_disparity = (1.0 / np.pi) * (T - tf.atan(tan_T - tf.tan(np.pi * disparity)))
         return tf.clip_by_value(tf.where(tf.is_finite(attenuated_disparity), attenuated_disparity, tf.zeros_like(attenuated_disparity)), 1e-6, 0.75)
     
     def rectilinear_disparity_to_depth(self, disparity, K, face, epsilon = 1e-6):
@@ -141,30 +176,27 @@ class MonodepthModel(object):
 
     def disparity_to_depth(self, disparity, position, epsilon = 1e-6):
         baseline_distance = self.params.baseline
-        S, T = lat_long_grid([tf.shape(disparity)[1], tf.shape(disparity)[2]])
-        _, T_grids = self.expand_grids(S, -T, tf.shape(disparity)[0])
+        T, tan_T, _, _ = latitude_tables(disparity)
+        t1 = -tan_T
         if position == "top":
-            t1 = tf.tan(T_grids)
-            t2 = tf.tan(T_grids + np.pi * disparity)
+            t2 = tf.tan(-T + np.pi * disparity)
         else:
-            t1 = tf.tan(T_grids)
-            t2 = tf.tan(T_grids - np.pi * disparity)
+            t2 = tf.tan(-T - np.pi * disparity)
         return baseline_distance / (tf.abs(t2 - t1) + epsilon)
 
     def depth_to_disparity(self, depth, position):
         baseline_distance = self.params.baseline
-        S, T = lat_long_grid([tf.shape(depth)[1], tf.shape(depth)[2]])
-        _, T_grids = self.expand_grids(S, T, tf.shape(depth)[0])
+        _, tan_T, _, sec2_T = latitude_tables(depth)
         if position == "top":
-            return self.disparity_scale * (np.pi / 2.0 - atan2(baseline_distance * depth, (1.0 + tf.tan(-T_grids) ** 2.0) * (depth ** 2.0) + baseline_distance * depth * tf.tan(-T_grids)))
+            return self.disparity_scale * (np.pi / 2.0 - atan2(baseline_distance * depth, sec2_T * (depth ** 2.0) - baseline_distance * depth * tan_T))
         else:
-            return self.disparity_scale * (atan2(baseline_distance * depth, (1.0 + tf.tan(-T_grids) ** 2.0) * (depth ** 2.0) - baseline_distance * depth * tf.tan(-T_grids)) - np.pi / 2.0)
+            return self.disparity_scale * (atan2(baseline_distance * depth, sec2_T * (depth ** 2.0) + baseline_distance * depth * tan_T) - np.pi / 2.0)
 
     def generate_image_top(self, img, disp):
-        return bilinear_sample(img, x_t = None, y_t = None, x_offset = 0.0, y_offset = -disp)
+        return vertical_sample(img, -disp)
 
     def generate_image_bottom(self, img, disp):
-        return bilinear_sample(img, x_t = None, y_t = None, x_offset = 0.0, y_offset = disp)
+        return vertical_sample(img, disp)
 
     def SSIM(self, x, y):
         C1 = 0.01 ** 2
@@ -184,6 +216,14 @@ class MonodepthModel(object):
 
         return tf.clip_by_value((1 - SSIM) / 2, 0, 1)
 
+    def heteroscedastic_image_loss(self, ssim, l1, log_scale):
+        # Laplace negative log-likelihood of the residuals with a predicted per-pixel scale.
+        # SSIM maps are computed with VALID pooling, so the scales are cropped to match.
+        inverse_scale = tf.exp(-log_scale)
+        ssim_loss = tf.reduce_mean(ssim * inverse_scale[:, 1:-1, 1:-1, :] + log_scale[:, 1:-1, 1:-1, :])
+        l1_loss = tf.reduce_mean(l1 * inverse_scale + log_scale)
+        return self.params.alpha_image_loss * ssim_loss + (1 - self.params.alpha_image_loss) * l1_loss
+
     def get_smoothness(self, input_images, pyramid):
         gradients_x = [self.gradient_x(tf.abs(i)) for i in input_images]
         gradients_y = [self.gradient_y(tf.abs(i)) for i in input_images]
@@ -206,9 +246,15 @@ class MonodepthModel(object):
         depth = self.conv(x, 2, 3, 1, tf.nn.relu) + epsilon
         return depth
 
+    def pad(self, x, p):
+        # Cube faces are padded with pixels from their neighbouring faces, anything else with zeros.
+        if self.params.projection == 'cubic':
+            return cube_pad(x, p)
+        return tf.pad(x, [[0, 0], [p, p], [p, p], [0, 0]])
+
     def conv(self, x, num_out_layers, kernel_size, stride, activation_fn = tf.nn.elu):
         p = np.floor((kernel_size - 1) / 2).astype(np.int32)
-        p_x = tf.pad(x, [[0, 0], [p, p], [p, p], [0, 0]])
+        p_x = self.pad(x, p)
         return slim.conv2d(p_x, num_out_layers, kernel_size, stride, 'VALID', activation_fn = activation_fn)
 
     def conv_block(self, x, num_out_layers, kernel_size):
@@ -218,7 +264,7 @@ class MonodepthModel(object):
 
     def maxpool(self, x, kernel_size):
         p = np.floor((kernel_size - 1) / 2).astype(np.int32)
-        p_x = tf.pad(x, [[0, 0], [p, p], [p, p], [0, 0]])
+        p_x = self.pad(x, p)
         return slim.max_pool2d(p_x, kernel_size)
 
     def resconv(self, x, num_layers, stride):
@@ -233,11 +279,17 @@ class MonodepthModel(object):
             shortcut = x
         return tf.nn.elu(conv3 + shortcut)
 
+    def checkpoint(self, fn, *inputs):
+        # Recompute the activations of fn during backpropagation instead of storing them.
+        if self.params.recompute and self.mode == 'train':
+            return recompute_grad(fn)(*inputs)
+        return fn(*inputs)
+
     def resblock(self, x, num_layers, num_blocks):
         out = x
         for i in range(num_blocks - 1):
-            out = self.resconv(out, num_layers, 1)
-        out = self.resconv(out, num_layers, 2)
+            out = self.checkpoint(lambda x: self.resconv(x, num_layers, 1), out)
+        out = self.checkpoint(lambda x: self.resconv(x, num_layers, 2), out)
         return out
 
     def upconv(self, x, num_out_layers, kernel_size, scale):
@@ -246,7 +298,7 @@ class MonodepthModel(object):
         return conv
 
     def deconv(self, x, num_out_layers, kernel_size, scale):
-        p_x = tf.pad(x, [[0, 0], [1, 1], [1, 1], [0, 0]])
+        p_x = self.pad(x, 1)
         conv = slim.conv2d_transpose(p_x, num_out_layers, kernel_size, scale, 'SAME')
         return conv[:,3:-1,3:-1,:]
 
@@ -276,77 +328,59 @@ class MonodepthModel(object):
 
         return image_aug
 
-    def noisy_resnet50(self, input, scope):
-        iterations = 8
-        outputs1 = []
-        outputs2 = []
-        outputs3 = []
-        outputs4 = []
-
-        noisy_input = [self.random_noise(input) for _ in range(iterations)]
-
-        for iteration in range(iterations):
-            output1, output2, output3, output4 = self.resnet50(noisy_input)
-            outputs1.append(output1)
-            outputs2.append(output2)
-            outputs3.append(output3)
-            outputs4.append(output4)
-            if iteration + 1 < iterations:
-                scope.reuse_variables()
-
-        mean1 = tf.add_n(outputs1) / iterations
-        mean2 = tf.add_n(outputs2) / iterations
-        mean3 = tf.add_n(outputs3) / iterations
-        mean4 = tf.add_n(outputs4) / iterations
-
-        variance1 = tf.add_n([(output - mean1) ** 2.0 for output in outputs1]) / (iterations - 1)
-        variance2 = tf.add_n([(output - mean2) ** 2.0 for output in outputs2]) / (iterations - 1)
-        variance3 = tf.add_n([(output - mean3) ** 2.0 for output in outputs3]) / (iterations - 1)
-        variance4 = tf.add_n([(output - mean4) ** 2.0 for output in outputs4]) / (iterations - 1)
+    def sample_groups(self):
+        # Cube faces stay outermost in the batch when it is repeated for sampling.
+        return 6 if self.params.projection == 'cubic' else 1
+
+    def sample_statistics(self, outputs, iterations):
+        # Welford's streaming mean and variance over samples repeated by tile_samples.
+        groups = self.sample_groups()
+        means = []
+        for output in outputs:
+            shape = tf.shape(output)[1:]
+            samples = tf.unstack(tf.reshape(output, tf.concat([[groups, iterations, -1], shape], 0)), iterations, 1)
+            mean = samples[0]
+            m2 = tf.zeros_like(mean)
+            for index, sample in enumerate(samples[1:]):
+                delta = sample - mean
+                mean += delta / (index + 2.0)
+                m2 += delta * (sample - mean)
+            variance = m2 / (iterations - 1)
+            means.append((tf.reshape(mean, tf.concat([[-1], shape], 0)), tf.reshape(variance, tf.concat([[-1], shape], 0))))
 
         with tf.variable_scope("confidence"):
-            self.confidence1 = variance1
-            self.confidence2 = variance2
-            self.confidence3 = variance3
-            self.confidence4 = variance4
+            self.set_confidences([variance for _, variance in means])
 
-        return mean1, mean2, mean3, mean4
+        return [mean for mean, _ in means]
 
-    def dropout_resnet50(self, input, scope):
-        iterations = 8
-        outputs1 = []
-        outputs2 = []
-        outputs3 = []
-        outputs4 = []
-
-        for iteration in range(iterations):
-            output1, output2, output3, output4 = self.resnet50(input, True)
-            outputs1.append(output1)
-            outputs2.append(output2)
-            outputs3.append(output3)
-            outputs4.append(output4)
-            if iteration + 1 < iterations:
-                scope.reuse_variables()
-
-        mean1 = tf.add_n(outputs1) / iterations
-        mean2 = tf.add_n(outputs2) / iterations
-        mean3 = tf.add_n(outputs3) / iterations
-        mean4 = tf.add_n(outputs4) / iterations
-
-        variance1 = tf.add_n([(output - mean1) ** 2.0 for output in outputs1]) / (iterations - 1)
-        variance2 = tf.add_n([(output - mean2) ** 2.0 for output in outputs2]) / (iterations - 1)
-        variance3 = tf.add_n([(output - mean3) ** 2.0 for output in outputs3]) / (iterations - 1)
-        variance4 = tf.add_n([(output - mean4) ** 2.0 for output in outputs4]) / (iterations - 1)
+    def set_confidences(self, confidences):
+        # Confidence maps of the built scales, finest first.
+        self.confidences = confidences
+        for index, confidence in enumerate(confidences):
+            setattr(self, "confidence{}".format(index + 1), confidence)
 
-        with tf.variable_scope("confidence"):
-            self.confidence1 = variance1
-            self.confidence2 = variance2
-            self.confidence3 = variance3
-            self.confidence4 = variance4
+    def noisy_resnet50(self, input):
+        # All noisy copies of the input go through the network as one batch.
+        iterations = 8
+        noisy_input = self.random_noise(tile_samples(input, iterations, self.sample_groups()))
+        return self.sample_statistics(self.resnet50(noisy_input)[:self.num_scales], iterations)
 
-        return mean1, mean2, mean3, mean4
+    def dropout_resnet50(self, input):
+        # The encoder is deterministic up to the first dropout layer, so only the remaining
+        # layers run once per sample, batched.
+        iterations = 8
+        return self.sample_statistics(self.resnet50(input, True, iterations)[:self.num_scales], iterations)
+
+    def resnet50(self, input, dropout = False, samples = 1):
+        if self.params.precision == 'mixed' and input.dtype != tf.float16:
+            # Run the layers in float16 on float32 master variables, and hand float32 outputs
+            # to the samplers, depth conversions and losses.
+            with tf.variable_scope(tf.get_variable_scope(), custom_getter = float32_variable_getter):
+                outputs = self.resnet50(tf.cast(input, tf.float16), dropout, samples)
+            if self.params.confidence_head:
+                self.log_scales = [tf.cast(log_scale, tf.float32) for log_scale in self.log_scales]
+            return [tf.cast(output, tf.float32) for output in outputs]
 
-    def resnet50(self, input, dropout = False):
         conv = self.conv
         if self.params.use_deconv:
             upconv = self.deconv
@@ -367,6 +401,9 @@ class MonodepthModel(object):
             pool1 = self.maxpool(conv1,           3) # H/4  -   64D
             conv2 = self.resblock(pool1,      64, 3) # H/8  -  256D
             conv3 = self.resblock(conv2,     128, 4) # H/16 -  512D
+            if samples > 1:
+                # Repeat the deterministic prefix (and skips) once per sample.
+                conv1, pool1, conv2, conv3 = [tile_samples(x, samples, self.sample_groups()) for x in [conv1, pool1, conv2, conv3]]
             conv3 = dropout_function(conv3)
             conv4 = self.resblock(conv3,     256, 6) # H/32 - 1024D
             conv4 = dropout_function(conv4)
@@ -380,46 +417,49 @@ class MonodepthModel(object):
             skip4 = conv3
             skip5 = conv4
 
+        # Decoder stage: upconv, concatenation with the skips, then iconv.
+        def decoder_stage(num_out_layers):
+            return lambda x, *skips: conv(tf.concat([upconv(x, num_out_layers, 3, 2)] + list(skips), 3), num_out_layers, 3, 1)
+
         # DECODING
         with tf.variable_scope('decoder'):
-            upconv6 = upconv(conv5,   512, 3, 2) #H/32
-            concat6 = tf.concat([upconv6, skip5], 3)
-            iconv6  = conv(concat6,   512, 3, 1)
+            iconv6  = self.checkpoint(decoder_stage(512), conv5, skip5) #H/32
 
-            upconv5 = upconv(iconv6, 256, 3, 2) #H/16
-            concat5 = tf.concat([upconv5, skip4], 3)
-            iconv5  = conv(concat5,   256, 3, 1)
+            iconv5  = self.checkpoint(decoder_stage(256), iconv6, skip4) #H/16
 
-            upconv4 = upconv(iconv5,  128, 3, 2) #H/8
-            concat4 = tf.concat([upconv4, skip3], 3)
-            iconv4  = conv(concat4,   128, 3, 1)
+            iconv4  = self.checkpoint(decoder_stage(128), iconv5, skip3) #H/8
             output4 = get_layer(iconv4)
             udepth4  = self.upsample_nn(output4, 2)
 
-            upconv3 = upconv(iconv4,   64, 3, 2) #H/4
-            concat3 = tf.concat([upconv3, skip2, udepth4], 3)
-            iconv3  = conv(concat3,    64, 3, 1)
+            iconv3  = self.checkpoint(decoder_stage(64), iconv4, skip2, udepth4) #H/4
             output3 = get_layer(iconv3)
             udepth3  = self.upsample_nn(output3, 2)
 
-            upconv2 = upconv(iconv3,   32, 3, 2) #H/2
-            concat2 = tf.concat([upconv2, skip1, udepth3], 3)
-            iconv2  = conv(concat2,    32, 3, 1)
+            iconv2  = self.checkpoint(decoder_stage(32), iconv3, skip1, udepth3) #H/2
             output2 = get_layer(iconv2)
             udepth2  = self.upsample_nn(output2, 2)
 
-            upconv1 = upconv(iconv2,  16, 3, 2) #H
-            concat1 = tf.concat([upconv1, udepth2], 3)
-            iconv1  = conv(concat1,   16, 3, 1)
+            iconv1  = self.checkpoint(decoder_stage(16), iconv2, udepth2) #H
             output1 = get_layer(iconv1)
 
-            return output1, output2, output3, output4
+        if self.params.confidence_head:
+            # Log scales of the top and bottom reconstruction residuals. Separate scope, so that
+            # the decoder variables keep their names.
+            with tf.variable_scope('uncertainty'):
+                self.log_scales = [conv(iconv, 2, 3, 1, None) for iconv in [iconv1, iconv2, iconv3, iconv4][:self.num_scales]]
+
+        return output1, output2, output3, output4
+
+    def learned_confidence(self, log_scales):
+        self.log_scales = log_scales
+        with tf.variable_scope("confidence"):
+            self.set_confidences([tf.exp(log_scale) for log_scale in log_scales])
 
     def equirectangular_net(self):
         with slim.arg_scope([slim.conv2d, slim.conv2d_transpose], activation_fn = tf.nn.elu):
-            with tf.variable_scope("model", reuse = self.reuse_variables) as scope:
+            with tf.variable_scope("model", reuse = self.reuse_variables):
                 # Calculate pyramid for equirectangular top image.
-                self.top_pyramid = self.scale_pyramid(self.top, 4)
+                self.top_pyramid = self.scale_pyramid(self.top, self.num_scales)
 
                 with tf.variable_scope("scaling"):
                     self.depth_scale = tf.constant(0.25, shape = [1])
@@ -427,9 +467,9 @@ class MonodepthModel(object):
                                                            initializer = tf.constant_initializer(1.0 / np.pi))
 
                 if self.params.dropout:
-                    resnet50 = lambda x: self.dropout_resnet50(x, scope)
+                    resnet50 = self.dropout_resnet50
                 elif self.params.noise:
-                    resnet50 = lambda x: self.noisy_resnet50(x, scope)
+                    resnet50 = self.noisy_resnet50
                 else:
                     resnet50 = lambda x: self.resnet50(x, False)
 
@@ -437,15 +477,26 @@ class MonodepthModel(object):
                     # Calculate pyramid for equirectangular bottom image.
                     self.bottom_pyramid = self.scale_pyramid(self.bottom, 4)
 
-                if self.params.test_crop:
-                    crop_height = int(self.params.height / 8)
-                    output1, output2, output3, output4 = resnet50(self.top[:, crop_height:-crop_height, :, :])
+                # Run the network on the band about the equator, and pad the polar rows back.
+                if self.params.test_crop or self.train_crop:
+                    crop_height = self.params.height // 8
+                    outputs = resnet50(self.top[:, crop_height:-crop_height, :, :])
                 else:
-                    output1, output2, output3, output4 = resnet50(self.top)
-                outputs = [output1, output2, output3, output4]
-
-                if self.params.test_crop:
-                    outputs = [restore(output, self.params.height) for output in outputs]
+                    outputs = resnet50(self.top)
+                outputs = list(outputs)[:self.num_scales]
+
+                # Training mirrors the band edges into the polar rows, so that warps near the edges of the
+                # band sample plausible disparities.
+                restore_mode = "SYMMETRIC" if self.train_crop else "CONSTANT"
+                if self.params.test_crop or self.train_crop:
+                    pyramid_shapes = self.pyramid_shapes([self.params.height, self.params.width], self.num_scales)
+                    outputs = [restore(output, shape[0], restore_mode) for output, shape in zip(outputs, pyramid_shapes)]
+
+                if self.params.confidence_head:
+                    if self.params.test_crop or self.train_crop:
+                        self.learned_confidence([restore(log_scale, shape[0], restore_mode) for log_scale, shape in zip(self.log_scales, pyramid_shapes)])
+                    else:
+                        self.learned_confidence(self.log_scales)
 
                 if self.params.output_mode == "indirect":
                     self.outputs = [self.equirectangular_disparity_to_depth(output) for output in outputs]
@@ -458,9 +509,11 @@ class MonodepthModel(object):
                         ) for output in outputs]
 
     def get_intrinsics(self):
-        # Settings for overlap in rectilinear faces.
+        # Settings for overlap in rectilinear faces. Cube padded faces do not overlap.
         #padding_scale = 1.5
         padding_scale = 2.0
+        if self.params.projection == 'cubic':
+            padding_scale = 1.0
         zoom = 1.0 / padding_scale
         # Intrinsic parameters from zoom level.
         K = [zoom, zoom, 0.0, 0.0]
@@ -469,28 +522,32 @@ class MonodepthModel(object):
     
     def rectilinear_net(self):
         K = self.get_intrinsics()
-        batch_size = tf.shape(self.top)[0]
         with slim.arg_scope([slim.conv2d, slim.conv2d_transpose], activation_fn = tf.nn.elu):
-            with tf.variable_scope("model", reuse = self.reuse_variables) as scope:
+            with tf.variable_scope("model", reuse = self.reuse_variables):
                 # Calculate pyramid for equirectangular top image.
-                self.top_pyramid = self.scale_pyramid(self.top, 4)
-                square_size = self.params.height / 2
-
-                # Convert top image into cubic format.
-                self.top_faces = [tf.reshape(face,
-                                             [batch_size, square_size, square_size, 3]) for face in
-                                  equirectangular_to_rectilinear(self.top,
-                                                                 K,
-                                                           [square_size, square_size])]
+                self.top_pyramid = self.scale_pyramid(self.top, self.num_scales)
+
+                # Tight cube faces keep the angular resolution of the overlapping faces with half the size.
+                if self.params.projection == 'cubic':
+                    square_size = self.params.height // 4
+                else:
+                    square_size = self.params.height // 2
+
+                # Convert top image into cubic format, with the faces along the batch axis
+                # (face-major), so that all faces go through the network in one pass.
+                top_faces = equirectangular_to_rectilinear(self.top, K, [square_size, square_size], stacked = True)
+                top_faces = tf.reshape(tf.transpose(top_faces, [1, 0, 2, 3, 4]), [-1, square_size, square_size, 3])
+                self.top_faces = tf.split(top_faces, 6, 0)
+
                 with tf.variable_scope("scaling"):
                     self.depth_scale = tf.constant(0.25, shape=[1])
                     self.disparity_scale = tf.get_variable("disparity_scale", shape = [1], trainable = False,
                                                            initializer = tf.constant_initializer(1.0 / np.pi))
 
                 if self.params.dropout:
-                    resnet50 = lambda x: self.dropout_resnet50(x, scope)
+                    resnet50 = self.dropout_resnet50
                 elif self.params.noise:
-                    resnet50 = lambda x: self.noisy_resnet50(x, scope)
+                    resnet50 = self.noisy_resnet50
                 else:
                     resnet50 = lambda x: self.resnet50(x, False)
 
@@ -498,25 +555,14 @@ class MonodepthModel(object):
                     # Calculate pyramid for equirectangular bottom image.
                     self.bottom_pyramid = self.scale_pyramid(self.bottom, 4)
 
-                # Calculate disparity and depth maps for each face direction individually.
-                output_pyramids = [[] for _ in range(4)]
-                pyramid_shapes = self.pyramid_shapes([self.params.height, self.params.width], 4)
-
-                for face_index in range(6):
-                    output1, output2, output3, output4 = resnet50(self.top_faces[face_index])
-                    if face_index < 5:
-                        scope.reuse_variables()
-
-                    if self.params.output_mode == "indirect":
-                        output_pyramids[0].append(self.rectilinear_disparity_to_depth(output1, K, face_map[face_index]))
-                        output_pyramids[1].append(self.rectilinear_disparity_to_depth(output2, K, face_map[face_index]))
-                        output_pyramids[2].append(self.rectilinear_disparity_to_depth(output3, K, face_map[face_index]))
-                        output_pyramids[3].append(self.rectilinear_disparity_to_depth(output4, K, face_map[face_index]))
-                    elif self.params.output_mode == "direct" or self.params.output_mode == "attenuate":
-                        output_pyramids[0].append(output1)
-                        output_pyramids[1].append(output2)
-                        output_pyramids[2].append(output3)
-                        output_pyramids[3].append(output4)
+                # Calculate disparity and depth maps for all face directions at once, then split per face.
+                output_pyramids = [tf.split(output, 6, 0) for output in list(resnet50(top_faces))[:self.num_scales]]
+                pyramid_shapes = self.pyramid_shapes([self.params.height, self.params.width], self.num_scales)
+
+                if self.params.output_mode == "indirect":
+                    output_pyramids = [[self.rectilinear_disparity_to_depth(output, K, face_map[face_index])
+                                        for face_index, output in enumerate(outputs)]
+                                       for outputs in output_pyramids]
 
                 # Convert depth maps to equirectangular format.
                 self.outputs = [
@@ -525,8 +571,20 @@ class MonodepthModel(object):
                         K,
                         pyramid_shapes[scale_index]
                     )
-                    for scale_index in range(4)
+                    for scale_index in range(self.num_scales)
                 ]
+
+                # Confidence maps are per face as well.
+                if self.params.dropout or self.params.noise:
+                    self.set_confidences([
+                        rectilinear_to_equirectangular(tf.split(confidence, 6, 0), K, pyramid_shapes[scale_index])
+                        for scale_index, confidence in enumerate(self.confidences)
+                    ])
+                elif self.params.confidence_head:
+                    self.learned_confidence([
+                        rectilinear_to_equirectangular(tf.split(log_scale, 6, 0), K, pyramid_shapes[scale_index])
+                        for scale_index, log_scale in enumerate(self.log_scales)
+                    ])
                 
                 if self.params.output_mode == "attenuate":
                     self.outputs = [tf.concat(
@@ -562,7 +620,7 @@ class MonodepthModel(object):
     def build_outputs(self):
         # Generate bottom image.
         with tf.variable_scope('images'):
-            self.bottom_est = [self.generate_image_bottom(self.top_pyramid[i], self.disparity_bottom_est[i]) for i in range(4)]
+            self.bottom_est = [self.generate_image_bottom(self.top_pyramid[i], self.disparity_bottom_est[i]) for i in range(self.num_scales)]
 
         if self.mode == 'test':
             return
@@ -592,47 +650,50 @@ class MonodepthModel(object):
     def build_losses(self):
         with tf.variable_scope('losses', reuse = self.reuse_variables):
             # L1
-            self.l1_top = [tf.abs(self.top_est[i] - self.top_pyramid[i]) for i in range(4)]
+            self.l1_top = [self.latitude_band(tf.abs(self.top_est[i] - self.top_pyramid[i]), i) for i in range(4)]
             self.l1_reconstruction_loss_top  = [tf.reduce_mean(l) for l in self.l1_top]
-            self.l1_bottom = [tf.abs(self.bottom_est[i] - self.bottom_pyramid[i]) for i in range(4)]
+            self.l1_bottom = [self.latitude_band(tf.abs(self.bottom_est[i] - self.bottom_pyramid[i]), i) for i in range(4)]
             self.l1_reconstruction_loss_bottom = [tf.reduce_mean(l) for l in self.l1_bottom]
 
             # SSIM
-            self.ssim_top = [self.SSIM(self.top_est[i],  self.top_pyramid[i]) for i in range(4)]
+            self.ssim_top = [self.SSIM(self.latitude_band(self.top_est[i], i),  self.latitude_band(self.top_pyramid[i], i)) for i in range(4)]
             self.ssim_loss_top  = [tf.reduce_mean(s) for s in self.ssim_top]
-            self.ssim_bottom = [self.SSIM(self.bottom_est[i], self.bottom_pyramid[i]) for i in range(4)]
+            self.ssim_bottom = [self.SSIM(self.latitude_band(self.bottom_est[i], i), self.latitude_band(self.bottom_pyramid[i], i)) for i in range(4)]
             self.ssim_loss_bottom = [tf.reduce_mean(s) for s in self.ssim_bottom]
 
             # WEIGTHED SUM
             self.image_loss_bottom = [self.params.alpha_image_loss * self.ssim_loss_bottom[i] + (1 - self.params.alpha_image_loss) * self.l1_reconstruction_loss_bottom[i] for i in range(4)]
             self.image_loss_top  = [self.params.alpha_image_loss * self.ssim_loss_top[i]  + (1 - self.params.alpha_image_loss) * self.l1_reconstruction_loss_top[i]  for i in range(4)]
+            if self.params.confidence_head:
+                self.image_loss_top = [self.heteroscedastic_image_loss(self.ssim_top[i], self.l1_top[i], self.latitude_band(self.log_scales[i][:, :, :, 0:1], i)) for i in range(4)]
+                self.image_loss_bottom = [self.heteroscedastic_image_loss(self.ssim_bottom[i], self.l1_bottom[i], self.latitude_band(self.log_scales[i][:, :, :, 1:2], i)) for i in range(4)]
             self.image_loss = tf.add_n(self.image_loss_top + self.image_loss_bottom)
 
             # DISPARITY SMOOTHNESS
-            self.disparity_top_loss  = [tf.reduce_mean(tf.abs(self.disparity_top_smoothness[i]))  / 2 ** i for i in range(4)]
-            self.disparity_bottom_loss = [tf.reduce_mean(tf.abs(self.disparity_bottom_smoothness[i])) / 2 ** i for i in range(4)]
+            self.disparity_top_loss  = [tf.reduce_mean(tf.abs(self.latitude_band(self.disparity_top_smoothness[i], i)))  / 2 ** i for i in range(4)]
+            self.disparity_bottom_loss = [tf.reduce_mean(tf.abs(self.latitude_band(self.disparity_bottom_smoothness[i], i))) / 2 ** i for i in range(4)]
             self.disparity_gradient_loss = tf.add_n(self.disparity_top_loss + self.disparity_bottom_loss)
             
             if self.params.dual_loss:
-                self.depth_top_loss  = [tf.reduce_mean(tf.abs(self.depth_top_smoothness[i]))  / 2 ** i for i in range(4)]
-                self.depth_bottom_loss  = [tf.reduce_mean(tf.abs(self.depth_bottom_smoothness[i]))  / 2 ** i for i in range(4)]
+                self.depth_top_loss  = [tf.reduce_mean(tf.abs(self.latitude_band(self.depth_top_smoothness[i], i)))  / 2 ** i for i in range(4)]
+                self.depth_bottom_loss  = [tf.reduce_mean(tf.abs(self.latitude_band(self.depth_bottom_smoothness[i], i)))  / 2 ** i for i in range(4)]
                 self.depth_gradient_loss = tf.add_n(self.depth_top_loss + self.depth_bottom_loss)
                 self.smoothness_loss = 0.25 * self.depth_gradient_loss + self.disparity_gradient_loss
             else:
                 self.smoothness_loss = self.disparity_gradient_loss
             
             # TB CONSISTENCY
-            self.tb_top_loss  = [tf.reduce_mean(tf.abs(self.bottom_to_top_disparity[i] - tf.abs(self.disparity_top_est[i])))  for i in range(4)]
-            self.tb_bottom_loss = [tf.reduce_mean(tf.abs(self.top_to_bottom_disparity[i] - tf.abs(self.disparity_bottom_est[i]))) for i in range(4)]
+            self.tb_top_loss  = [tf.reduce_mean(self.latitude_band(tf.abs(self.bottom_to_top_disparity[i] - tf.abs(self.disparity_top_est[i])), i))  for i in range(4)]
+            self.tb_bottom_loss = [tf.reduce_mean(self.latitude_band(tf.abs(self.top_to_bottom_disparity[i] - tf.abs(self.disparity_bottom_est[i])), i)) for i in range(4)]
             if self.params.dual_loss:
-                self.tb_top_loss_depth  = [0.25 * tf.reduce_mean(tf.abs(self.bottom_to_top_depth[i] - tf.log(1.0 + tf.abs(self.depth_top_est[i]))))  for i in range(4)]
-                self.tb_bottom_loss_depth = [0.25 * tf.reduce_mean(tf.abs(self.top_to_bottom_depth[i] - tf.log(1.0 + tf.abs(self.depth_bottom_est[i])))) for i in range(4)]
+                self.tb_top_loss_depth  = [0.25 * tf.reduce_mean(self.latitude_band(tf.abs(self.bottom_to_top_depth[i] - tf.log(1.0 + tf.abs(self.depth_top_est[i]))), i))  for i in range(4)]
+                self.tb_bottom_loss_depth = [0.25 * tf.reduce_mean(self.latitude_band(tf.abs(self.top_to_bottom_depth[i] - tf.log(1.0 + tf.abs(self.depth_bottom_est[i]))), i)) for i in range(4)]
                 self.tb_loss = tf.add_n(self.tb_top_loss + self.tb_bottom_loss + self.tb_top_loss_depth + self.tb_bottom_loss_depth)
             else:
                 self.tb_loss = tf.add_n(self.tb_top_loss + self.tb_bottom_loss)
 
-            self.depth_metrics = self.get_metrics(self.depth_top_est[0])
-            self.disparity_metrics = self.get_metrics(self.disparity_top_est[0])
+            self.depth_metrics = self.get_metrics(self.latitude_band(self.depth_top_est[0], 0))
+            self.disparity_metrics = self.get_metrics(self.latitude_band(self.disparity_top_est[0], 0))
 
             # TOTAL LOSS
             self.total_loss = self.image_loss + self.params.smoothness_loss_weight * self.smoothness_loss + self.params.tb_loss_weight * self.tb_loss
@@ -667,17 +728,19 @@ class MonodepthModel(object):
             tf.summary.scalar('disparity_mean', tf.reshape(self.disparity_metrics[2], []), collections = self.model_collection)
 
             # Network outputs.
-            tf.summary.image('disparity_top_est', tf.abs(self.disparity_top_est[0]), max_outputs=4, collections = self.model_collection)
-            tf.summary.image('disparity_bottom_est', tf.abs(self.disparity_bottom_est[0]), max_outputs=4, collections = self.model_collection)
-            tf.summary.image('depth_top_est', normalize_depth(perpendicular_to_distance(self.depth_top_est[0])), max_outputs=4, collections = self.model_collection)
-            tf.summary.image('depth_bottom_est', normalize_depth(perpendicular_to_distance(self.depth_bottom_est[0])), max_outputs = 4, collections = self.model_collection)
+            tf.summary.image('disparity_top_est', tf.abs(self.disparity_top_est[0]), max_outputs=4, collections = self.image_collection)
+            tf.summary.image('disparity_bottom_est', tf.abs(self.disparity_bottom_est[0]), max_outputs=4, collections = self.image_collection)
+            tf.summary.image('depth_top_est', normalize_depth(perpendicular_to_distance(self.depth_top_est[0])), max_outputs=4, collections = self.image_collection)
+            tf.summary.image('depth_bottom_est', normalize_depth(perpendicular_to_distance(self.depth_bottom_est[0])), max_outputs = 4, collections = self.image_collection)
+            if self.params.confidence_head:
+                tf.summary.image('confidence_top', self.normalize_image(self.confidence1[:, :, :, 0:1]), max_outputs = 4, collections = self.image_collection)
 
             # Image reconstruction summaries.
-            tf.summary.image('top_est', self.top_est[0], max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('bottom_est', self.bottom_est[0], max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('ssim_top', self.ssim_top[0],  max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('ssim_bottom', self.ssim_bottom[0], max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('l1_top', self.l1_top[0],  max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('l1_bottom', self.l1_bottom[0], max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('top',  self.top_pyramid[0],   max_outputs = 4, collections = self.model_collection)
-            tf.summary.image('bottom', self.bottom_pyramid[0],  max_outputs = 4, collections = self.model_collection)
+            tf.summary.image('top_est', self.top_est[0], max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('bottom_est', self.bottom_est[0], max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('ssim_top', self.ssim_top[0],  max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('ssim_bottom', self.ssim_bottom[0], max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('l1_top', self.l1_top[0],  max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('l1_bottom', self.l1_bottom[0], max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('top',  self.top_pyramid[0],   max_outputs = 4, collections = self.image_collection)
+            tf.summary.image('bottom', self.bottom_pyramid[0],  max_outputs = 4, collections = self.image_collection)
@@ -0,0 +1,58 @@
+import numpy as np
+import spherical_numpy
+import tensorflow as tf
+
+from monodepth_model import *
+
+def test_parameters(**overrides):
+    # Default monodepth_main parameters for a single 256x512 image, with overrides.
+    parameters = dict(
+        height = 256, width = 512, batch_size = 1, num_threads = 1, num_epochs = 1, projection = "equirectangular",
+        baseline = 0.2, output_mode = "direct", use_deconv = False, alpha_image_loss = 0.75,
+        smoothness_loss_weight = 1.0, dual_loss = False, crop = False, test_crop = False, dropout = False,
+        noise = False, tb_loss_weight = 1.0, full_summary = False, input_pipeline = "queue", seed = None,
+        cache_path = "", rectification_cache_path = "", shuffle_buffer = 1024, uint8_buffer = False,
+        confidence_head = False, precision = "float32", accumulate_steps = 1, recompute = False,
+        train_crop = False)
+    parameters.update(overrides)
+    return monodepth_parameters(**parameters)
+
+def cubic_model_test():
+    # Build and run the cube padded model at the smallest height monodepth_main accepts for it,
+    # where the coarsest faces are a single pixel.
+    params = test_parameters(projection = "cubic", use_deconv = True)
+
+    with tf.Graph().as_default():
+        top = tf.random_uniform([1, 256, 512, 3])
+        bottom = tf.random_uniform([1, 256, 512, 3])
+        model = MonodepthModel(params, "train", top, bottom)
+        session = tf.Session()
+        session.run(tf.global_variables_initializer())
+        loss = session.run(model.total_loss)
+    print("cubic model: loss {:.6f}".format(loss))
+    assert np.isfinite(loss)
+
+def sample_layout_test():
+    # Dropout and noise samples of cube faces must keep the faces outermost in the batch, so that
+    # cube padding finds the neighbouring faces, and the sample statistics must undo the tiling.
+    size = 8
+    directions = []
+    for face in face_map:
+        x, y, z = spherical_numpy.xyz_grid([size, size], face)
+        directions.append(np.stack([x, y, z], 2))
+    faces = tf.constant(np.repeat(np.stack(directions), 2, 0).astype(np.float32))
+
+    model = MonodepthModel.__new__(MonodepthModel)
+    model.params = test_parameters(projection = "cubic")
+    tiled_faces = tile_samples(faces, 8, model.sample_groups())
+    padded_error = tf.reduce_max(tf.abs(cube_pad(tiled_faces, 2) - tile_samples(cube_pad(faces, 2), 8, model.sample_groups())))
+    mean, = model.sample_statistics([tiled_faces], 8)
+    session = tf.Session()
+
+    padded_error, mean_error, variance = session.run([padded_error, tf.reduce_max(tf.abs(mean - faces)), model.confidence1])
+    print("sample layout: padded error {:.6f}, mean error {:.6f}".format(padded_error, mean_error))
+    assert padded_error == 0.0 and mean_error == 0.0 and np.abs(variance).max() == 0.0
+
+if __name__ == "__main__":
+    cubic_model_test()
+    sample_layout_test()
@@ -0,0 +1,61 @@
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+# Activation recomputation (gradient checkpointing). Only the inputs and outputs of a segment
+# wrapped with recompute_grad are kept from the forward pass. The segment runs again when
+# backpropagation reaches it, and its gradients are taken from the recomputed activations.
+
+recompute_count = [0]
+
+def recompute_grad(fn):
+    # fn maps tensors to a tensor, and may create or reuse variables through get_variable.
+    def wrapped(*inputs):
+        inputs = [tf.convert_to_tensor(x) for x in inputs]
+        scope = tf.get_variable_scope()
+        outer_getter = scope.custom_getter
+        arg_scope = slim.current_arg_scope()
+
+        # Record the variables of the segment in order, without entering a new variable scope,
+        # so that layer names are the same as without recomputation.
+        variables = []
+        def recording_getter(getter, *args, **kwargs):
+            if outer_getter is not None:
+                variable = outer_getter(getter, *args, **kwargs)
+            else:
+                variable = getter(*args, **kwargs)
+            variables.append(variable)
+            return variable
+
+        scope.set_custom_getter(recording_getter)
+        try:
+            output = fn(*inputs)
+        finally:
+            scope.set_custom_getter(outer_getter)
+        variable_tensors = [tf.convert_to_tensor(variable) for variable in variables]
+
+        def grad_fn(op, *grads):
+            output_grad = grads[-1]
+            replayed = iter(variables)
+            def replaying_getter(getter, *args, **kwargs):
+                return next(replayed)
+
+            # Recompute once the gradient of the output is available, with the recorded variables.
+            with tf.control_dependencies([output_grad]):
+                recomputed_inputs = [tf.identity(x) for x in inputs]
+            with slim.arg_scope(arg_scope):
+                with tf.variable_scope(None, default_name = "recompute", custom_getter = replaying_getter):
+                    with tf.control_dependencies([output_grad]):
+                        recomputed_output = fn(*recomputed_inputs)
+
+            input_grads = tf.gradients(recomputed_output, recomputed_inputs + variable_tensors, grad_ys = [output_grad])
+            return input_grads + [None]
+
+        # Route the gradients of the segment through grad_fn. The segment output only receives a
+        # gradient through the identity, so the forward activations are not kept for backpropagation.
+        recompute_count[0] += 1
+        gradient_name = "RecomputeGrad_{}".format(recompute_count[0])
+        tf.RegisterGradient(gradient_name)(grad_fn)
+        with tf.get_default_graph().gradient_override_map({"IdentityN": gradient_name}):
+            return tf.identity_n(inputs + variable_tensors + [output])[-1]
+
+    return wrapped
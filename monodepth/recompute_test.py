@@ -0,0 +1,53 @@
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from mixed_precision import float32_variable_getter
+from monodepth_model import MonodepthModel
+from monodepth_model_test import test_parameters
+
+def segment_model(recompute, precision = "float32"):
+    # A model with only the parameters its layers read, to build single segments.
+    model = MonodepthModel.__new__(MonodepthModel)
+    model.params = test_parameters(recompute = recompute, precision = precision)
+    model.mode = "train"
+    return model
+
+def segment_gradients(recompute, inputs, skip, dtype, reuse):
+    # Gradients of a resblock followed by a decoder stage with respect to the inputs and all
+    # variables. float16 layers keep float32 variables through float32_variable_getter.
+    model = segment_model(recompute)
+    custom_getter = float32_variable_getter if dtype == tf.float16 else None
+    with slim.arg_scope([slim.conv2d, slim.conv2d_transpose], activation_fn = tf.nn.elu):
+        with tf.variable_scope("segment", reuse = reuse, custom_getter = custom_getter):
+            x = tf.cast(inputs, dtype)
+            encoded = model.resblock(x, 8, 2)
+            decoder_stage = lambda x, skip: model.conv(tf.concat([model.upconv(x, 16, 3, 2), skip], 3), 16, 3, 1)
+            output = model.checkpoint(decoder_stage, encoded, tf.cast(skip, dtype))
+    loss = tf.reduce_sum(tf.cast(output, tf.float32) ** 2.0)
+    variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, "segment")
+    return variables, tf.gradients(loss, [inputs, skip] + variables)
+
+def recompute_grad_test():
+    # Gradients through recompute_grad must match plain backpropagation, for the same variables.
+    # The float16 comparison goes through the float32_variable_getter path of mixed precision.
+    for dtype, tolerance in [(tf.float32, 1e-5), (tf.float16, 2e-2)]:
+        with tf.Graph().as_default():
+            inputs = tf.constant(np.random.uniform(-1.0, 1.0, [2, 16, 32, 8]).astype(np.float32))
+            skip = tf.constant(np.random.uniform(-1.0, 1.0, [2, 16, 32, 4]).astype(np.float32))
+            variables, plain_gradients = segment_gradients(False, inputs, skip, dtype, None)
+            recomputed_variables, recomputed_gradients = segment_gradients(True, inputs, skip, dtype, True)
+            assert [variable.name for variable in variables] == [variable.name for variable in recomputed_variables]
+            assert all(variable.dtype.base_dtype == tf.float32 for variable in variables)
+            assert all(gradient is not None for gradient in recomputed_gradients)
+
+            session = tf.Session()
+            session.run(tf.global_variables_initializer())
+            plain_data, recomputed_data = session.run([plain_gradients, recomputed_gradients])
+            max_error = max(np.abs(plain - recomputed).max() / max(np.abs(plain).max(), 1e-12)
+                            for plain, recomputed in zip(plain_data, recomputed_data))
+        print("recompute_grad ({}): {} gradients, max relative error {:.3e}".format(dtype.name, len(plain_data), max_error))
+        assert max_error < tolerance
+
+if __name__ == "__main__":
+    recompute_grad_test()
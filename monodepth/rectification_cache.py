@@ -0,0 +1,152 @@
+from __future__ import print_function
+
+import argparse
+import hashlib
+import numpy as np
+import os
+import tensorflow as tf
+
+from spherical import rotate
+
+# Content-addressed cache of top images rectified with their calibration angles at training
+# resolution. Entries are uint8 .npy files named by a hash of the source image contents, the
+# angles and the resolution, so they stay valid when files move and are rebuilt when they change.
+# manifest.txt records the size, modification time and hash of every source image, so that
+# images only need hashing again after they change.
+
+def parse_args():
+    # Construct argument parser.
+    parser = argparse.ArgumentParser(description = "Build an offline rectification cache.")
+    parser.add_argument("--data_path", type = str, help = "Path to the data.", required = True)
+    parser.add_argument("--filenames_file", type = str, help = "Path to the filenames text file with rx ry rz columns.", required = True)
+    parser.add_argument("--cache_path", type = str, help = "Output directory for the cache.", required = True)
+    parser.add_argument("--input_height", type = int, help = "Training height.", default = 256)
+    parser.add_argument("--input_width", type = int, help = "Training width.", default = 512)
+    parser.add_argument("--num_threads", type = int, help = "Number of processing threads.", default = 8)
+
+    # Parse arguments.
+    return parser.parse_args()
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_directory(path):
+    # Tolerates another process creating the directory at the same time.
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+class RectificationCache(object):
+    """Rectified image cache"""
+
+    def __init__(self, cache_path, shape):
+        self.cache_path = cache_path
+        self.shape = list(shape)
+        self.manifest_path = os.path.join(cache_path, "manifest.txt")
+        self.manifest = self.read_manifest()
+        self.manifest_changed = False
+
+    def read_manifest(self):
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                for line in manifest_file:
+                    path, size, mtime, digest = line.rsplit(None, 3)
+                    manifest[path] = (int(size), float(mtime), digest)
+        return manifest
+
+    def digest(self, image_path):
+        path = os.path.abspath(image_path)
+        status = os.stat(path)
+        entry = self.manifest.get(path)
+        if entry is None or entry[0] != status.st_size or entry[1] != status.st_mtime:
+            entry = (status.st_size, status.st_mtime, file_digest(path))
+            self.manifest[path] = entry
+            self.manifest_changed = True
+        return entry[2]
+
+    def entry_path(self, image_path, rx, ry, rz):
+        angles = " ".join("{:.9g}".format(float(angle)) for angle in [rx, ry, rz])
+        key = "{} {} {}x{}".format(self.digest(image_path), angles, self.shape[0], self.shape[1])
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_path, key[:2], key + ".npy")
+
+    def lookup(self, image_path, rx, ry, rz):
+        # Returns the cached rectified image path, or None if it has not been built.
+        path = self.entry_path(image_path, rx, ry, rz)
+        if os.path.exists(path):
+            return path
+        return None
+
+    def save_manifest(self):
+        if not self.manifest_changed:
+            return
+        make_directory(self.cache_path)
+
+        # Training workers share the cache, so keep the entries other workers saved since this one
+        # read the manifest, and replace the manifest with a complete file in a single rename so
+        # that readers never see a partial one.
+        for path, entry in self.read_manifest().items():
+            self.manifest.setdefault(path, entry)
+        temporary_path = "{}.{}.tmp".format(self.manifest_path, os.getpid())
+        with open(temporary_path, "w") as manifest_file:
+            for path in sorted(self.manifest):
+                size, mtime, digest = self.manifest[path]
+                manifest_file.write("{} {} {!r} {}\n".format(path, size, mtime, digest))
+        os.rename(temporary_path, self.manifest_path)
+        self.manifest_changed = False
+
+def rectify_image(image_path, angles, shape):
+    # Same decode, resize and rotation as the training dataloader, quantized to uint8.
+    image = tf.image.decode_jpeg(tf.read_file(image_path), channels = 3)
+    image = tf.image.convert_image_dtype(image, tf.float32)
+    image = tf.image.resize_images(image, shape, tf.image.ResizeMethod.AREA)
+    image = rotate(tf.expand_dims(image, 0), angles[0:1], angles[1:2], angles[2:3])[0, :, :, :]
+    return tf.image.convert_image_dtype(image, tf.uint8, saturate = True)
+
+def build_cache(arguments):
+    shape = [arguments.input_height, arguments.input_width]
+    cache = RectificationCache(arguments.cache_path, shape)
+
+    # Collect the images which are not cached yet.
+    image_paths = []
+    angles = []
+    entry_paths = []
+    with open(arguments.filenames_file, "r") as f:
+        for line in f:
+            split_line = line.split()
+            if len(split_line) < 4:
+                continue
+            image_path = os.path.join(arguments.data_path, "top", split_line[0] + ".jpg")
+            entry_path = cache.entry_path(image_path, *split_line[1:4])
+            if not os.path.exists(entry_path) and entry_path not in entry_paths:
+                image_paths.append(image_path)
+                angles.append([float(angle) for angle in split_line[1:4]])
+                entry_paths.append(entry_path)
+    cache.save_manifest()
+    print("Rectifying {} images".format(len(image_paths)))
+
+    if not image_paths:
+        return
+
+    with tf.Graph().as_default(), tf.Session() as session:
+        dataset = tf.data.Dataset.from_tensor_slices((tf.constant(image_paths), tf.constant(angles, dtype = tf.float32)))
+        dataset = dataset.map(lambda image_path, image_angles: rectify_image(image_path, image_angles, shape),
+                              num_parallel_calls = arguments.num_threads).prefetch(arguments.num_threads)
+        rectified_image = dataset.make_one_shot_iterator().get_next()
+
+        for entry_path in entry_paths:
+            make_directory(os.path.dirname(entry_path))
+            # Write to a temporary file first so that interrupted builds leave no partial entries.
+            temporary_path = entry_path[:-4] + ".tmp.npy"
+            np.save(temporary_path, session.run(rectified_image))
+            os.rename(temporary_path, entry_path)
+
+if __name__ == "__main__":
+    build_cache(parse_args())
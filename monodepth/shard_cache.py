@@ -0,0 +1,103 @@
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import tensorflow as tf
+
+# Cache of training pairs decoded and resized once to training resolution. Pairs are stored
+# as uint8 [num_pairs, 2, height, width, 3] arrays (top then bottom) in .npy shards that are
+# memory-mapped when training, and index.txt maps each name to its shard and row.
+
+def parse_args():
+    # Construct argument parser.
+    parser = argparse.ArgumentParser(description = "Build a pre-decoded training shard cache.")
+    parser.add_argument("--data_path", type = str, help = "Path to the data.", required = True)
+    parser.add_argument("--filenames_file", type = str, help = "Path to the filenames text file.", required = True)
+    parser.add_argument("--cache_path", type = str, help = "Output directory for the shards.", required = True)
+    parser.add_argument("--input_height", type = int, help = "Training height.", default = 256)
+    parser.add_argument("--input_width", type = int, help = "Training width.", default = 512)
+    parser.add_argument("--shard_size", type = int, help = "Number of pairs per shard.", default = 1024)
+    parser.add_argument("--num_threads", type = int, help = "Number of decoding threads.", default = 8)
+
+    # Parse arguments.
+    return parser.parse_args()
+
+def shard_filename(shard_index):
+    return "shard_{:05d}.npy".format(shard_index)
+
+def read_names(filenames_file):
+    # First column of each line, duplicates removed but order kept.
+    names = []
+    seen = set()
+    with open(filenames_file, "r") as f:
+        for line in f:
+            split_line = line.split()
+            if split_line and split_line[0] not in seen:
+                seen.add(split_line[0])
+                names.append(split_line[0])
+    return names
+
+def decode_pair(data_path, name, shape):
+    # Same decode and AREA resize as MonodepthDataloader.read_image, quantized back to uint8.
+    def decode(image_path):
+        image = tf.image.decode_jpeg(tf.read_file(image_path), channels = 3)
+        image = tf.image.convert_image_dtype(image, tf.float32)
+        image = tf.image.resize_images(image, shape, tf.image.ResizeMethod.AREA)
+        return tf.image.convert_image_dtype(image, tf.uint8, saturate = True)
+
+    top_image = decode(tf.string_join([data_path, "/top/", name, ".jpg"]))
+    bottom_image = decode(tf.string_join([data_path, "/bottom/", name, ".jpg"]))
+    return tf.stack([top_image, bottom_image])
+
+def build_cache(arguments):
+    names = read_names(arguments.filenames_file)
+    shape = [arguments.input_height, arguments.input_width]
+    if not os.path.exists(arguments.cache_path):
+        os.makedirs(arguments.cache_path)
+
+    with tf.Graph().as_default(), tf.Session() as session:
+        dataset = tf.data.Dataset.from_tensor_slices(tf.constant(names))
+        dataset = dataset.map(lambda name: decode_pair(arguments.data_path, name, shape), num_parallel_calls = arguments.num_threads)
+        dataset = dataset.batch(arguments.shard_size).prefetch(1)
+        pairs = dataset.make_one_shot_iterator().get_next()
+
+        with open(os.path.join(arguments.cache_path, "index.txt"), "w") as index_file:
+            for shard_index in range(int(np.ceil(len(names) / float(arguments.shard_size)))):
+                shard_pairs = session.run(pairs)
+                shard = np.lib.format.open_memmap(os.path.join(arguments.cache_path, shard_filename(shard_index)),
+                                                  mode = "w+", dtype = np.uint8, shape = shard_pairs.shape)
+                shard[:] = shard_pairs
+                shard.flush()
+                del shard
+
+                for row in range(shard_pairs.shape[0]):
+                    index_file.write("{} {} {}\n".format(names[shard_index * arguments.shard_size + row], shard_index, row))
+                print("Wrote shard {} ({} pairs)".format(shard_index, shard_pairs.shape[0]))
+
+class ShardCache(object):
+    """Read-only view of a shard cache"""
+
+    def __init__(self, cache_path):
+        self.index = {}
+        num_shards = 0
+        with open(os.path.join(cache_path, "index.txt"), "r") as index_file:
+            for line in index_file:
+                name, shard_index, row = line.split()
+                self.index[name] = (int(shard_index), int(row))
+                num_shards = max(num_shards, int(shard_index) + 1)
+
+        # Shards are memory-mapped, so reading a pair only touches its own pages.
+        self.shards = [np.load(os.path.join(cache_path, shard_filename(shard_index)), mmap_mode = "r")
+                       for shard_index in range(num_shards)]
+        self.shape = list(self.shards[0].shape[2:4]) if self.shards else None
+
+    def read(self, name):
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+        shard_index, row = self.index[name]
+        pair = self.shards[shard_index][row]
+        return pair[0], pair[1]
+
+if __name__ == "__main__":
+    build_cache(parse_args())
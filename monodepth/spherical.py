@@ -1,6 +1,8 @@
 from bilinear_sampler import bilinear_sample
+from bilinear_sampler import remap
 
 import numpy as np
+import spherical_numpy
 import tensorflow as tf
 
 #  Taken from asos-ben implementation at https://github.com/tensorflow/tensorflow/issues/6095
@@ -43,6 +45,24 @@ def uv_grid(shape):
     return tf.meshgrid(tf.linspace(-0.5, 0.5, shape[1]),
                        tf.linspace(-0.5, 0.5, shape[0]))
 
+# Latitude tables (T, tan T, cos T, sec^2 T) for the rows of [batch, height, width, channels]
+# equirectangular images, shaped [1, height, 1, 1] to broadcast along batch and width.
+def latitude_tables(images, epsilon = 1.0e-12):
+    height = images.get_shape()[1].value
+    if height is not None:
+        return [tf.constant(np.reshape(table, [1, -1, 1, 1])) for table in spherical_numpy.get_latitude_tables(height, epsilon)]
+    T = tf.reshape(tf.linspace(-np.pi / 2.0 + epsilon, np.pi / 2.0 - epsilon, tf.shape(images)[1]), [1, -1, 1, 1])
+    tan_T = tf.tan(T)
+    return [T, tan_T, tf.cos(T), 1.0 + tan_T ** 2.0]
+
+# Longitude tables (sin S, cos S), shaped [1, 1, width, 1].
+def longitude_tables(images):
+    width = images.get_shape()[2].value
+    if width is not None:
+        return [tf.constant(np.reshape(table, [1, 1, -1, 1])) for table in spherical_numpy.get_longitude_tables(width)]
+    S = tf.reshape(tf.linspace(-np.pi, np.pi, tf.shape(images)[2]), [1, 1, -1, 1])
+    return [tf.sin(S), tf.cos(S)]
+
 # Restricted rotations of (a, b, c) to (x, y, z), implemented using
 # permutations and negations.
 def switch_face(a, b, c, face = "front"):
@@ -339,8 +359,35 @@ def fast_rotate(input_image, dx = 0, dy = 0):
     # Perform exact sampling (as we are using integer coordinates).
     return tf.gather_nd(input_image, indices)
 
+def static_dims(shape):
+    # Python integer dimensions if they are known when building the graph, otherwise None.
+    if isinstance(shape, tf.Tensor):
+        return None
+    dims = [dim.value if isinstance(dim, tf.Dimension) else dim for dim in shape]
+    if any(dim is None or isinstance(dim, tf.Tensor) for dim in dims):
+        return None
+    return tuple(int(dim) for dim in dims)
+
+def static_image_shape(input_images):
+    shape = input_images.get_shape()
+    if shape.ndims != 4:
+        return None
+    return static_dims(shape[1:3])
+
+# Sample using a cached projection map. Returns None if the shapes are not static.
+def cached_projection(input_images, projection, target_shape, face = None, K = None):
+    source_shape = static_image_shape(input_images)
+    target_shape = static_dims(target_shape)
+    if source_shape is None or target_shape is None:
+        return None
+    indices, weights = spherical_numpy.get_projection_map(projection, source_shape, target_shape, face, K)
+    return remap(input_images, indices, weights, target_shape)
+
 # Project equirectangular image onto a cube face.
 def project_face(input_images, face, cubic_shape):
+    output = cached_projection(input_images, "cubic", cubic_shape, face)
+    if output is not None:
+        return output
     x, y, z = xyz_grid(cubic_shape, face)
     S, T = xyz_to_lat_long(x, y, z)
     u, v = lat_long_to_equirectangular_uv(S, T)
@@ -348,11 +395,52 @@ def project_face(input_images, face, cubic_shape):
 
 # Project equirectangular image into rectilinear camera image using given intrinsics K.
 def project_rectilinear(input_images, K, face, face_shape):
+    output = cached_projection(input_images, "rectilinear", face_shape, face, K)
+    if output is not None:
+        return output
     x, y, z = rectilinear_xyz(K, face_shape, face)
     S, T = xyz_to_lat_long(x, y, z)
     u, v = lat_long_to_equirectangular_uv(S, T)
     return bilinear_sample(input_images, u, v)
 
+# Project equirectangular image onto several faces with a single sampling pass. The face
+# grids are stacked vertically, so the output reshapes directly to [batch, faces, height, width, channels].
+def project_faces(input_images, projection, faces, face_shape, K = None):
+    faces = tuple(faces)
+    output = cached_projection(input_images, projection, [len(faces) * face_shape[0], face_shape[1]], faces, K)
+    if output is None:
+        if projection == "rectilinear":
+            grids = [rectilinear_xyz(K, face_shape, face) for face in faces]
+        else:
+            grids = [xyz_grid(face_shape, face) for face in faces]
+        x, y, z = [tf.concat(coordinates, 0) for coordinates in zip(*grids)]
+        S, T = xyz_to_lat_long(x, y, z)
+        u, v = lat_long_to_equirectangular_uv(S, T)
+        output = bilinear_sample(input_images, u, v)
+
+    num_channels = input_images.get_shape()[3].value or tf.shape(input_images)[3]
+    return tf.reshape(output, tf.stack([-1, len(faces), face_shape[0], face_shape[1], num_channels]))
+
+# Pad [6 * batch, size, size, channels] faces (face-major, in face_map order) with pixels
+# unfolded from the neighbouring faces, so that convolutions see across cube edges.
+def cube_pad(faces, padding):
+    padding = int(padding)
+    if padding == 0:
+        return faces
+    size = faces.get_shape()[1].value
+    if size is None or faces.get_shape()[2].value != size:
+        raise ValueError("Cube padding needs square faces of static size, got {}.".format(faces.get_shape()))
+    batch_size = tf.shape(faces)[0] // 6
+    num_channels = faces.get_shape()[3].value or tf.shape(faces)[3]
+    padded_size = size + 2 * padding
+
+    # Move pixels to the leading axis so that one gather pads all faces of the batch.
+    pixels = tf.reshape(faces, tf.stack([6, batch_size, size * size, num_channels]))
+    pixels = tf.reshape(tf.transpose(pixels, [0, 2, 1, 3]), tf.stack([6 * size * size, batch_size, num_channels]))
+    padded = tf.gather(pixels, tf.constant(spherical_numpy.cube_padding_indices(size, padding)))
+    padded = tf.transpose(padded, [0, 3, 1, 2, 4])
+    return tf.reshape(padded, tf.stack([6 * batch_size, padded_size, padded_size, num_channels]))
+
 def stack_faces(faces):
     # Stack faces horizontally on image plane.
     # Used for bilinear sampling on from multiple images - for cube map and rectilinear projections.
@@ -360,47 +448,44 @@ def stack_faces(faces):
 
 # Convert spherical depth to distance.
 def perpendicular_to_distance(depths):
-    batch_size = tf.shape(depths)[0]
-    height = tf.shape(depths)[1]
-    width = tf.shape(depths)[2]
-
-    S, T = lat_long_grid([height, width])
-    S_grids = tf.tile(tf.reshape(S, [1, height, width, 1]), [batch_size, 1, 1, 1])
-    T_grids = tf.tile(tf.reshape(T, [1, height, width, 1]), [batch_size, 1, 1, 1])
-
-    x, y, z = backproject(S_grids, T_grids, depths)
-
-    return tf.sqrt(x ** 2.0 + y ** 2.0 + z ** 2.0)
+    # sqrt(x^2 + y^2 + z^2) of the backprojected point, with x^2 + z^2 = depth^2 and y = depth * tan(T).
+    _, _, _, sec2_T = latitude_tables(depths)
+    return tf.abs(depths) * tf.sqrt(sec2_T)
 
 # Backproject equirectangular image to a point cloud from given depth values.
 def equirectangular_to_pc(input_images, depths):
     batch_size = tf.shape(input_images)[0]
-    height = tf.shape(input_images)[1]
-    width = tf.shape(input_images)[2]
-
-    S, T = lat_long_grid([height, width])
-    S_grids = tf.tile(tf.reshape(S, [1, height, width, 1]), [batch_size, 1, 1, 1])
-    T_grids = tf.tile(tf.reshape(T, [1, height, width, 1]), [batch_size, 1, 1, 1])
+    _, tan_T, _, _ = latitude_tables(input_images)
+    sin_S, cos_S = longitude_tables(input_images)
 
-    X = tf.stack(backproject(S_grids, T_grids, depths), 3)
-    pc = tf.stack([tf.squeeze(X, 4), input_images], 3)
+    X = tf.concat([depths * sin_S, depths * tan_T, depths * cos_S], 3)
+    pc = tf.concat([X, input_images], 3)
 
     return tf.reshape(pc, [batch_size, -1, 6])
 
-def equirectangular_to_cubic(input_images, cubic_shape):
-    return [project_face(input_images, face, cubic_shape) for face in face_map]
+# Returns a list of faces, or a single [batch, faces, height, width, channels] tensor if stacked is set.
+def equirectangular_to_cubic(input_images, cubic_shape, faces = face_map, stacked = False):
+    cubic_images = project_faces(input_images, "cubic", faces, cubic_shape)
+    return cubic_images if stacked else tf.unstack(cubic_images, len(faces), 1)
 
-def equirectangular_to_rectilinear(input_images, K, face_shape):
-    return [project_rectilinear(input_images, K, face, face_shape) for face in face_map]
+def equirectangular_to_rectilinear(input_images, K, face_shape, faces = face_map, stacked = False):
+    rectilinear_images = project_faces(input_images, "rectilinear", faces, face_shape, K)
+    return rectilinear_images if stacked else tf.unstack(rectilinear_images, len(faces), 1)
 
 def cubic_to_equirectangular(input_images, equirectangular_shape):
     stacked_faces = stack_faces(input_images)
+    output = cached_projection(stacked_faces, "cubic_to_equirectangular", equirectangular_shape)
+    if output is not None:
+        return output
     S, T = lat_long_grid(equirectangular_shape)
     u, v = lat_long_to_cube_uv(S, T)
     return bilinear_sample(stacked_faces, u, v)
 
 def rectilinear_to_equirectangular(input_images, K, equirectangular_shape):
     stacked_faces = stack_faces(input_images)
+    output = cached_projection(stacked_faces, "rectilinear_to_equirectangular", equirectangular_shape, K = K)
+    if output is not None:
+        return output
     S, T = lat_long_grid(equirectangular_shape)
     u, v = lat_long_to_rectilinear_uv(K, S, T)
     return bilinear_sample(stacked_faces, u, v)
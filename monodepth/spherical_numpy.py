@@ -0,0 +1,436 @@
+import numpy as np
+
+# NumPy implementation of the spherical image module (spherical.py). It does not
+# depend on TensorFlow, so CPU-side tools can convert images without building a graph,
+# and the TensorFlow module uses it to precompute projection maps once per shape.
+# All image functions work on batches of shape [batch, height, width, channels].
+
+def atan2(x, y, epsilon = 1.0e-12):
+    # Same argument order and zero handling as spherical.atan2.
+    x = np.where(np.equal(x, 0.0), x + epsilon, x)
+    y = np.where(np.equal(y, 0.0), y + epsilon, y)
+
+    angle = np.where(np.greater(x, 0.0), np.arctan(y / x), np.zeros_like(x))
+    angle = np.where(np.logical_and(np.less(x, 0.0), np.greater_equal(y, 0.0)), np.arctan(y / x) + np.pi, angle)
+    angle = np.where(np.logical_and(np.less(x, 0.0), np.less(y, 0.0)), np.arctan(y / x) - np.pi, angle)
+    return angle
+
+# List of faces for consistent ordering.
+face_map = [
+    "front",
+    "back",
+    "left",
+    "right",
+    "up",
+    "down"
+]
+
+def lat_long_grid(shape, epsilon = 1.0e-12):
+    return np.meshgrid(np.linspace(-np.pi, np.pi, shape[1]),
+                       np.linspace(-np.pi / 2.0 + epsilon, np.pi / 2.0 - epsilon, shape[0]))
+
+# Latitude depends only on the row, so per-row tables (T, tan T, cos T, sec^2 T) are computed
+# once per height. Trig is evaluated on float32 latitudes, as the TensorFlow grids are.
+latitude_tables = {}
+
+def get_latitude_tables(height, epsilon = 1.0e-12):
+    height = int(height)
+    if height not in latitude_tables:
+        T = np.linspace(-np.pi / 2.0 + epsilon, np.pi / 2.0 - epsilon, height).astype(np.float32)
+        tan_T = np.tan(T)
+        latitude_tables[height] = (T, tan_T, np.cos(T), 1.0 + tan_T ** 2.0)
+    return latitude_tables[height]
+
+# Per-column (sin S, cos S) tables, cached per width.
+longitude_tables = {}
+
+def get_longitude_tables(width):
+    width = int(width)
+    if width not in longitude_tables:
+        S = np.linspace(-np.pi, np.pi, width).astype(np.float32)
+        longitude_tables[width] = (np.sin(S), np.cos(S))
+    return longitude_tables[width]
+
+# Restricted rotations of (a, b, c) to (x, y, z), implemented using
+# permutations and negations.
+def switch_face(a, b, c, face = "front"):
+    if face == "front":
+        x = a
+        y = -b
+        z = c
+    elif face == "back":
+        x = -a
+        y = -b
+        z = -c
+    elif face == "left":
+        x = -c
+        y = -b
+        z = a
+    elif face == "right":
+        x = c
+        y = -b
+        z = -a
+    elif face == "up":
+        x = a
+        y = c
+        z = b
+    else:
+        x = a
+        y = -c
+        z = -b
+
+    return x, y, z
+
+def xyz_grid(shape, face = "front"):
+    a, b = np.meshgrid(np.linspace(-1.0, 1.0, shape[1]),
+                       np.linspace(-1.0, 1.0, shape[0]))
+    c = np.ones(shape)
+
+    return switch_face(a, b, c, face)
+
+def rectilinear_xyz(K, shape, face = "front"):
+    u, v = np.meshgrid(np.linspace(-1.0, 1.0, shape[1]),
+                       np.linspace(-1.0, 1.0, shape[0]))
+    # X = (u - c_x) * z / f_x
+    # Y = (v - c_y) * z / f_y
+    a = (u - K[2]) / K[0]
+    b = (v - K[3]) / K[1]
+    c = np.ones(shape)
+
+    return switch_face(a, b, c, face)
+
+# Convert Cartesian coordinates (x, y, z) to latitude (T) and longitude (S).
+def xyz_to_lat_long(x, y, z):
+    S = - atan2(x, z)
+    T = atan2(y, np.sqrt(x ** 2.0 + z ** 2.0))
+    return S, T
+
+# Convert latitude (T) and longitude (S) to Cartesian coordinates (x, y, z).
+def lat_long_to_xyz(S, T):
+    x = np.cos(T) * np.sin(S)
+    y = np.sin(T)
+    z = np.cos(T) * np.cos(S)
+    return x, y, z
+
+# Index of the face each ray lies on, in face_map order. Ties are broken in the same
+# way as the tf.argmax based checks in spherical.py.
+def cube_face_index(x, y, z):
+    argmax = np.argmax(np.abs([x, y, z]), axis = 0)
+    index = np.where(z >= 0.0, 0, 1)
+    index = np.where(argmax == 0, np.where(x < 0.0, 2, 3), index)
+    index = np.where(argmax == 1, np.where(y < 0.0, 4, 5), index)
+    return index
+
+def lat_long_to_rectilinear_uv(K, S, T):
+    x, y, z = lat_long_to_xyz(S, T)
+    face_index = cube_face_index(x, y, z)
+
+    def project_u(x, y, z, offset):
+        return offset + 0.5 + (K[2] + K[0] * x / z) / 2.0
+
+    def project_v(x, y, z):
+        return 0.5 + (K[3] + K[1] * y / z) / 2.0
+
+    # Face-local coordinates (x, y, z) for each face, in face_map order.
+    local = [(x, y, z), (x, -y, z), (z, y, -x), (-z, y, x), (x, z, -y), (x, -z, y)]
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        u = np.select([face_index == index for index in range(6)],
+                      [project_u(a, b, c, float(index)) for index, (a, b, c) in enumerate(local)])
+        v = np.select([face_index == index for index in range(6)],
+                      [project_v(a, b, c) for a, b, c in local])
+
+    return u / 6.0, v
+
+def lat_long_to_cube_uv(S, T):
+    x, y, z = lat_long_to_xyz(S, T)
+    face_index = cube_face_index(x, y, z)
+
+    # Normalize coordinates.
+    max = np.max(np.abs([x, y, z]), axis = 0)
+    x = x / max
+    y = y / max
+    z = z / max
+
+    conditions = [face_index == index for index in range(6)]
+    u = np.select(conditions, [
+        0.5 + x / 2.0,
+        1.0 + (0.5 - x / 2.0),
+        2.0 + (0.5 + z / 2.0),
+        3.0 + (0.5 - z / 2.0),
+        4.0 + (0.5 + x / 2.0),
+        5.0 + (0.5 + x / 2.0)
+    ])
+    v = np.select(conditions, [
+        (1.0 + y) / 2.0,
+        (1.0 + y) / 2.0,
+        (1.0 + y) / 2.0,
+        (1.0 + y) / 2.0,
+        (1.0 + z) / 2.0,
+        (1.0 - z) / 2.0
+    ])
+
+    return u / 6.0, v
+
+def lat_long_to_equirectangular_uv(S, T):
+    # Convert latitude and longitude to UV coordinates
+    # on an equirectangular plane.
+    u = np.mod(S / (2.0 * np.pi) - 0.25, 1.0)
+    v = np.mod(T / np.pi, 1.0)
+    return u, v
+
+# Sampling coordinates in [0, 1] for each supported projection. Passing a sequence of
+# faces stacks their grids vertically in a single map.
+def projection_uv(projection, target_shape, face = None, K = None):
+    if isinstance(face, (list, tuple)):
+        face_shape = [target_shape[0] // len(face), target_shape[1]]
+        u, v = zip(*[projection_uv(projection, face_shape, single_face, K) for single_face in face])
+        return np.concatenate(u, 0), np.concatenate(v, 0)
+    elif projection == "cubic":
+        S, T = xyz_to_lat_long(*xyz_grid(target_shape, face))
+        return lat_long_to_equirectangular_uv(S, T)
+    elif projection == "rectilinear":
+        S, T = xyz_to_lat_long(*rectilinear_xyz(K, target_shape, face))
+        return lat_long_to_equirectangular_uv(S, T)
+    elif projection == "cubic_to_equirectangular":
+        return lat_long_to_cube_uv(*lat_long_grid(target_shape))
+    elif projection == "rectilinear_to_equirectangular":
+        return lat_long_to_rectilinear_uv(K, *lat_long_grid(target_shape))
+    else:
+        raise ValueError("Unknown projection {}.".format(projection))
+
+# Flat neighbour indices and bilinear weights matching bilinear_sampler.interpolate,
+# for sampling an image of the given shape at UV coordinates in [0, 1].
+def bilinear_map(u, v, shape):
+    height, width = shape[0], shape[1]
+    x = np.reshape(u, [-1]) * (width - 1)
+    y = np.reshape(v, [-1]) * (height - 1)
+
+    x0 = np.floor(x).astype(np.int64)
+    y0 = np.floor(y).astype(np.int64)
+    x1 = np.clip(x0 + 1, 0, width - 1)
+    y1 = np.clip(y0 + 1, 0, height - 1)
+    x0 = np.clip(x0, 0, width - 1)
+    y0 = np.clip(y0, 0, height - 1)
+
+    indices = np.stack([y0 * width + x0, y1 * width + x0, y0 * width + x1, y1 * width + x1], 1)
+    weights = np.stack([(x1 - x) * (y1 - y), (x1 - x) * (y - y0), (x - x0) * (y1 - y), (x - x0) * (y - y0)], 1)
+
+    return indices.astype(np.int32), weights.astype(np.float32)
+
+# Projection maps (neighbour indices and bilinear weights) depend only on the shapes,
+# face and intrinsics, so they are computed once and shared by both backends.
+projection_maps = {}
+
+def get_projection_map(projection, source_shape, target_shape, face = None, K = None):
+    source_shape = tuple(int(dim) for dim in source_shape)
+    target_shape = tuple(int(dim) for dim in target_shape)
+    key = (projection, source_shape, target_shape, face, None if K is None else tuple(K))
+    if key not in projection_maps:
+        u, v = projection_uv(projection, target_shape, face, K)
+        projection_maps[key] = bilinear_map(u, v, source_shape)
+    return projection_maps[key]
+
+# Inverse of switch_face: face-local (a, b, c) of (x, y, z), in face_map order.
+def face_local(x, y, z, face = "front"):
+    if face == "front":
+        return x, -y, z
+    elif face == "back":
+        return -x, -y, -z
+    elif face == "left":
+        return z, -y, -x
+    elif face == "right":
+        return -z, -y, x
+    elif face == "up":
+        return x, z, y
+    else:
+        return x, -z, -y
+
+# Cube padding maps depend only on the face size and the padding.
+cube_padding_maps = {}
+
+def cube_padding_indices(size, padding):
+    # Flat indices into six stacked [size, size] faces (face_map order) for each pixel of
+    # the six faces padded by padding pixels, [6, size + 2 * padding, size + 2 * padding].
+    # Padding pixels are unfolded over the cube edges onto the neighbouring faces. Corner
+    # pixels are unfolded over the edge they overflow most.
+    key = (int(size), int(padding))
+    if key in cube_padding_maps:
+        return cube_padding_maps[key]
+
+    # A single pixel face has no edges to unfold over, so its pixel is replicated into the padding.
+    if size == 1:
+        cube_padding_maps[key] = np.tile(np.reshape(np.arange(6, dtype = np.int32), [6, 1, 1]),
+                                         [1, 1 + 2 * padding, 1 + 2 * padding])
+        return cube_padding_maps[key]
+
+    # Face coordinates of the padded grid, with pixel centres at linspace(-1, 1, size) as in xyz_grid.
+    step = 2.0 / (size - 1)
+    a, b = np.meshgrid(-1.0 + step * np.arange(-padding, size + padding),
+                       -1.0 + step * np.arange(-padding, size + padding))
+    overflow_a = np.abs(a) - 1.0
+    overflow_b = np.abs(b) - 1.0
+    fold_a = np.logical_and(overflow_a > 0.0, overflow_a >= overflow_b)
+    fold_b = np.logical_and(overflow_b > 0.0, np.logical_not(fold_a))
+
+    # Fold overflowing coordinates onto the neighbouring face, clamping the other one.
+    c = np.where(fold_a, 1.0 - overflow_a, np.where(fold_b, 1.0 - overflow_b, 1.0))
+    a, b = np.where(fold_a, np.sign(a), np.where(fold_b, np.clip(a, -1.0, 1.0), a)), \
+           np.where(fold_b, np.sign(b), np.where(fold_a, np.clip(b, -1.0, 1.0), b))
+
+    # Pixels of the face itself are kept. On its outer rows and columns the neighbouring faces tie
+    # with it, so only the overflowing pixels are looked up on the neighbours.
+    inside = np.logical_not(np.logical_or(fold_a, fold_b))
+
+    indices = []
+    for face_index, face in enumerate(face_map):
+        x, y, z = switch_face(a, b, c, face)
+        local = [face_local(x, y, z, target) for target in face_map]
+        target_index = np.argmax([target_c for _, _, target_c in local], axis = 0)
+        target_index = np.where(inside, face_index, target_index)
+        target_a = np.choose(target_index, [target_a for target_a, _, _ in local])
+        target_b = np.choose(target_index, [target_b for _, target_b, _ in local])
+        column = np.clip(np.round((target_a + 1.0) / step), 0, size - 1).astype(np.int32)
+        row = np.clip(np.round((target_b + 1.0) / step), 0, size - 1).astype(np.int32)
+        indices.append((target_index * size + row) * size + column)
+
+    cube_padding_maps[key] = np.stack(indices).astype(np.int32)
+    return cube_padding_maps[key]
+
+def cube_pad(faces, padding):
+    # Pads [6 * batch, size, size, channels] faces (face-major) with pixels from their neighbours.
+    batch_size, size, _, channels = faces.shape
+    indices = cube_padding_indices(size, padding)
+    pixels = np.reshape(faces, [6, batch_size // 6, size * size, channels])
+    pixels = np.reshape(np.transpose(pixels, [0, 2, 1, 3]), [6 * size * size, batch_size // 6, channels])
+    padded = np.transpose(pixels[indices], [0, 3, 1, 2, 4])
+    return np.reshape(padded, [batch_size, size + 2 * padding, size + 2 * padding, channels])
+
+def remap(input_images, indices, weights, out_size):
+    # Sample with a map shared across the batch ([N, 4] indices and weights).
+    batch_size, height, width, channels = input_images.shape
+    pixels = np.reshape(input_images, [batch_size, height * width, channels]).astype(np.float32, copy = False)
+    output = np.einsum("bnkc,nk->bnc", pixels[:, indices], weights)
+    return np.reshape(output, [batch_size, out_size[0], out_size[1], channels])
+
+def bilinear_sample(input_images, u, v):
+    # Sample at UV coordinates in [0, 1], either shared ([height, width]) or
+    # per image ([batch, height, width]).
+    batch_size, height, width, channels = input_images.shape
+    out_size = np.shape(u)[-2:]
+    indices, weights = bilinear_map(u, v, [height, width])
+    if np.ndim(u) < 3:
+        return remap(input_images, indices, weights, out_size)
+
+    pixels = np.reshape(input_images, [batch_size, height * width, channels]).astype(np.float32, copy = False)
+    indices = np.reshape(indices, [batch_size, -1, 4])
+    weights = np.reshape(weights, [batch_size, -1, 4])
+    neighbours = pixels[np.arange(batch_size)[:, np.newaxis, np.newaxis], indices]
+    output = np.einsum("bnkc,bnk->bnc", neighbours, weights)
+    return np.reshape(output, [batch_size, out_size[0], out_size[1], channels])
+
+def stack_faces(faces):
+    # Stack faces horizontally on image plane.
+    return np.concatenate(faces, 2)
+
+# General rotation function given angles in (x, y, z) axes, one per image.
+def rotate(input_images, rx, ry, rz):
+    batch_size, height, width, _ = input_images.shape
+
+    # Convert to Cartesian.
+    S, T = lat_long_grid([height, width])
+    X = np.reshape(np.stack(lat_long_to_xyz(S, T)), [3, height * width])
+
+    # Construct rotation matrices (for inverse warp).
+    rx = - np.broadcast_to(np.asarray(rx, dtype = np.float64), [batch_size])
+    ry = - np.broadcast_to(np.asarray(ry, dtype = np.float64), [batch_size])
+    rz = - np.broadcast_to(np.asarray(rz, dtype = np.float64), [batch_size])
+    zero = np.zeros([batch_size])
+    one = np.ones([batch_size])
+
+    def batch_matrix(matrix):
+        return np.transpose(np.array(matrix), [2, 0, 1])
+
+    R = batch_matrix([
+            [np.cos(rz), - np.sin(rz), zero],
+            [np.sin(rz), np.cos(rz), zero],
+            [zero, zero, one]
+        ])
+    R = np.matmul(
+            batch_matrix([
+                [np.cos(ry), zero, np.sin(ry)],
+                [zero, one, zero],
+                [- np.sin(ry), zero, np.cos(ry)]
+            ]),
+        R)
+    R = np.matmul(
+            batch_matrix([
+                [one, zero, zero],
+                [zero, np.cos(rx), - np.sin(rx)],
+                [zero, np.sin(rx), np.cos(rx)]
+            ]),
+        R)
+
+    # Rotate coordinates.
+    X_rotated = np.reshape(np.matmul(R, X), [batch_size, 3, height, width])
+
+    # Convert back to equirectangular UV.
+    S_rotated, T_rotated = xyz_to_lat_long(X_rotated[:, 0, :, :], X_rotated[:, 1, :, :], X_rotated[:, 2, :, :])
+    u, v = lat_long_to_equirectangular_uv(S_rotated, T_rotated)
+
+    return bilinear_sample(input_images, u, 1.0 - v)
+
+def fast_rotate(input_image, dx = 0, dy = 0):
+    # Integer shifts of a single equirectangular image, with wrap-around.
+    return np.roll(input_image, (dy, dx), axis = (0, 1))
+
+def backproject(S, T, depth):
+    # Convert to Cartesian for modified depth input.
+    # depth = sqrt(x^2 + z^2).
+    x = depth * np.sin(S)
+    y = depth * np.tan(T)
+    z = depth * np.cos(S)
+    return x, y, z
+
+def lat_long_grids(shape):
+    # Latitude and longitude grids broadcastable against [batch, height, width, 1].
+    S, T = lat_long_grid(shape)
+    return S[np.newaxis, :, :, np.newaxis], T[np.newaxis, :, :, np.newaxis]
+
+# Convert spherical depth to distance.
+def perpendicular_to_distance(depths):
+    S, T = lat_long_grids(depths.shape[1:3])
+    x, y, z = backproject(S, T, depths)
+    return np.sqrt(x ** 2.0 + y ** 2.0 + z ** 2.0).astype(np.float32)
+
+# Backproject equirectangular image to a point cloud from given depth values.
+def equirectangular_to_pc(input_images, depths):
+    batch_size = input_images.shape[0]
+    S, T = lat_long_grids(input_images.shape[1:3])
+    X = np.concatenate(backproject(S, T, depths), 3)
+    pc = np.concatenate([X, input_images], 3).astype(np.float32)
+    return np.reshape(pc, [batch_size, -1, 6])
+
+def project(input_images, projection, target_shape, face = None, K = None):
+    indices, weights = get_projection_map(projection, input_images.shape[1:3], target_shape, face, K)
+    return remap(input_images, indices, weights, target_shape)
+
+def project_faces(input_images, projection, faces, face_shape, K = None):
+    faces = tuple(faces)
+    output = project(input_images, projection, [len(faces) * face_shape[0], face_shape[1]], faces, K)
+    return np.reshape(output, [output.shape[0], len(faces), face_shape[0], face_shape[1], output.shape[3]])
+
+# Returns a list of faces, or a single [batch, faces, height, width, channels] array if stacked is set.
+def equirectangular_to_cubic(input_images, cubic_shape, faces = face_map, stacked = False):
+    cubic_images = project_faces(input_images, "cubic", faces, cubic_shape)
+    return cubic_images if stacked else list(np.moveaxis(cubic_images, 1, 0))
+
+def equirectangular_to_rectilinear(input_images, K, face_shape, faces = face_map, stacked = False):
+    rectilinear_images = project_faces(input_images, "rectilinear", faces, face_shape, K)
+    return rectilinear_images if stacked else list(np.moveaxis(rectilinear_images, 1, 0))
+
+def cubic_to_equirectangular(input_images, equirectangular_shape):
+    return project(stack_faces(input_images), "cubic_to_equirectangular", equirectangular_shape)
+
+def rectilinear_to_equirectangular(input_images, K, equirectangular_shape):
+    return project(stack_faces(input_images), "rectilinear_to_equirectangular", equirectangular_shape, K = K)
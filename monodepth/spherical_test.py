@@ -1,5 +1,9 @@
+import numpy as np
+import spherical_numpy
 import tensorflow as tf
 
+from bilinear_sampler import bilinear_sample
+from bilinear_sampler import vertical_sample
 from image_utils import *
 from spherical import *
 
@@ -103,6 +107,154 @@ def equirectangular_to_pc_test():
     pc_data = session.run(pc)
     write_pc(pc_data[0], "pc_test.xyz")
 
+def numpy_backend_test():
+    # Load equirectangular image.
+    filename = "equirectangular"
+    session = tf.Session()
+    equirectangular_images = session.run(tf.tile(read_image(filename + ".jpg", [256, 512]), [2, 1, 1, 1]))
+    depths = np.random.uniform(1.0, 100.0, [2, 256, 512, 1]).astype(np.float32)
+
+    # Placeholders without static shapes, so that the TensorFlow module builds its own
+    # coordinate grids rather than sharing the NumPy projection maps.
+    tf_images = tf.placeholder(tf.float32, [None, None, None, 3])
+    tf_depths = tf.placeholder(tf.float32, [None, None, None, 1])
+    tf_faces = [tf.placeholder(tf.float32, [None, None, None, 3]) for _ in face_map]
+    feed_dict = {tf_images: equirectangular_images, tf_depths: depths}
+
+    cubic_images = spherical_numpy.equirectangular_to_cubic(equirectangular_images, [128, 128])
+    feed_dict.update(zip(tf_faces, cubic_images))
+
+    def check(name, tf_output, np_output, tolerance):
+        # Compare the largest error, so that local differences are not averaged away.
+        error = np.abs(np.asarray(session.run(tf_output, feed_dict)) - np.asarray(np_output))
+        print("{}: max error {:.6f}, mean error {:.6f}".format(name, error.max(), error.mean()))
+        assert error.max() < tolerance
+
+    rx = np.array([0.0, 0.2])
+    ry = np.array([-0.5, 0.5])
+    rz = np.array([0.1, 0.0])
+
+    check("equirectangular_to_cubic", equirectangular_to_cubic(tf_images, [128, 128]), cubic_images, 1e-4)
+    check("equirectangular_to_rectilinear", equirectangular_to_rectilinear(tf_images, K, [128, 128]),
+          spherical_numpy.equirectangular_to_rectilinear(equirectangular_images, K, [128, 128]), 1e-4)
+    check("cubic_to_equirectangular", cubic_to_equirectangular(tf_faces, [256, 512]),
+          spherical_numpy.cubic_to_equirectangular(cubic_images, [256, 512]), 1e-4)
+    check("fast_rotate", fast_rotate(tf_images[0], -256), spherical_numpy.fast_rotate(equirectangular_images[0], -256), 1e-6)
+
+    # Rotated pole rows sample a whole row of the source around the pole, where the two backends
+    # round to different pixels, so leave them out.
+    check("rotate", rotate(tf_images, tf.constant(rx, tf.float32), tf.constant(ry, tf.float32), tf.constant(rz, tf.float32))[:, 2:-2],
+          spherical_numpy.rotate(equirectangular_images, rx, ry, rz)[:, 2:-2], 2e-4)
+
+    # Distances diverge towards the poles, so compare relative errors away from them.
+    check("perpendicular_to_distance", perpendicular_to_distance(tf_depths)[:, 4:-4] / depths[:, 4:-4],
+          spherical_numpy.perpendicular_to_distance(depths)[:, 4:-4] / depths[:, 4:-4], 2e-4)
+    check("equirectangular_to_pc", equirectangular_to_pc(tf_images, tf_depths)[:, 2048:-2048] / 100.0,
+          spherical_numpy.equirectangular_to_pc(equirectangular_images, depths)[:, 2048:-2048] / 100.0, 2e-4)
+
+    # Static shapes use the cached latitude and longitude tables.
+    check("perpendicular_to_distance (static)", perpendicular_to_distance(tf.constant(depths))[:, 4:-4] / depths[:, 4:-4],
+          spherical_numpy.perpendicular_to_distance(depths)[:, 4:-4] / depths[:, 4:-4], 2e-4)
+    check("equirectangular_to_pc (static)", equirectangular_to_pc(tf.constant(equirectangular_images), tf.constant(depths))[:, 2048:-2048] / 100.0,
+          spherical_numpy.equirectangular_to_pc(equirectangular_images, depths)[:, 2048:-2048] / 100.0, 2e-4)
+
+def vertical_sample_test():
+    # Compare the vertical sampler with the bilinear sampler over the full width, including the
+    # last column, which the bilinear sampler gives zero weight. Elsewhere the bilinear sampler puts
+    # round-off weights on neighbouring columns, so the outputs differ slightly.
+    images = tf.constant(np.random.uniform(0.0, 1.0, [2, 64, 512, 3]).astype(np.float32))
+    offsets = tf.constant(np.random.uniform(-0.2, 0.2, [2, 64, 512, 1]).astype(np.float32))
+    bilinear_images = bilinear_sample(images, y_offset = offsets)
+    vertical_images = vertical_sample(images, offsets)
+    bilinear_gradients = tf.gradients(tf.reduce_sum(bilinear_images ** 2.0), offsets)[0]
+    vertical_gradients = tf.gradients(tf.reduce_sum(vertical_images ** 2.0), offsets)[0]
+    session = tf.Session()
+
+    bilinear_data, vertical_data, bilinear_gradient_data, vertical_gradient_data = session.run(
+        [bilinear_images, vertical_images, bilinear_gradients, vertical_gradients])
+    error = np.abs(bilinear_data - vertical_data)
+    gradient_error = np.abs(bilinear_gradient_data - vertical_gradient_data) / np.abs(bilinear_gradient_data).max()
+    print("vertical_sample: max error {:.6f}, last column error {:.6f}, max relative gradient error {:.6f}".format(
+        error.max(), error[:, :, -1].max(), gradient_error.max()))
+    assert error.max() < 2e-4
+    assert gradient_error.max() < 5e-4
+    assert np.abs(vertical_data[:, :, -1]).max() == 0.0
+
+def wrap_sample_test():
+    # With wrap-around, horizontal offsets are periodic in longitude: a full turn returns the image,
+    # a one column offset rolls it, and half a column averages neighbours across the seam. The
+    # last row is left out, rows are clamped and it gets zero weight as without wrap-around.
+    image_data = np.random.uniform(0.0, 1.0, [2, 16, 32, 3]).astype(np.float32)
+    images = tf.constant(image_data)
+    session = tf.Session()
+
+    for x_offset, expected in [(0.0, image_data), (1.0, image_data), (-1.0, image_data),
+                               (1.0 / 32, np.roll(image_data, -1, 2)),
+                               (-3.0 / 32, np.roll(image_data, 3, 2)),
+                               (0.5 / 32, 0.5 * (image_data + np.roll(image_data, -1, 2)))]:
+        error = np.abs(session.run(bilinear_sample(images, x_offset = x_offset, wrap = True)) - expected)[:, :-1].max()
+        print("wrap_sample: x_offset {:.4f}, max error {:.6f}".format(x_offset, error))
+        assert error < 1e-5
+
+def cube_pad_test():
+    # Pad tight cube faces of the test image and save them side by side.
+    equirectangular_image = read_image("equirectangular.jpg", [512, 1024])
+    faces = tf.transpose(equirectangular_to_cubic(equirectangular_image, [128, 128], stacked = True), [1, 0, 2, 3, 4])
+    faces = tf.reshape(faces, [6, 128, 128, 3])
+    padded_faces = cube_pad(faces, 16)
+    session = tf.Session()
+
+    padded_data, face_data = session.run([padded_faces, faces])
+    error = np.abs(padded_data - spherical_numpy.cube_pad(face_data, 16)).max()
+    print("cube_pad: max error {:.6f}, interior error {:.6f}".format(error, np.abs(padded_data[:, 16:-16, 16:-16] - face_data).max()))
+    assert error == 0.0
+
+    # Padding must leave the faces themselves untouched, including their outer rows and columns on
+    # the shared edges. Random faces, unlike projected ones, differ from their neighbours there.
+    for padding in [1, 3]:
+        random_faces = np.random.uniform(0.0, 1.0, [12, 8, 8, 3]).astype(np.float32)
+        padded_data = session.run(cube_pad(tf.constant(random_faces), padding))
+        assert np.array_equal(padded_data[:, padding:-padding, padding:-padding], random_faces)
+    image_data = session.run(encode_image(stack_faces(tf.unstack(tf.expand_dims(padded_faces, 1)))))
+    write_image(image_data, "cube_padded.jpg")
+
+def cube_pad_geometry_test():
+    # Pad faces whose pixels are their own viewing directions. A pixel padded d pixels beyond an
+    # edge must hold the direction d pixels into the adjacent face, folded over the shared edge.
+    size = 16
+    padding = 4
+    step = 2.0 / (size - 1)
+    directions = []
+    for face in face_map:
+        x, y, z = spherical_numpy.xyz_grid([size, size], face)
+        directions.append(np.stack([x, y, z], 2) / np.sqrt(x ** 2.0 + y ** 2.0 + z ** 2.0)[:, :, np.newaxis])
+    padded_faces = cube_pad(tf.constant(np.stack(directions).astype(np.float32)), padding)
+    session = tf.Session()
+    padded_data = session.run(padded_faces)
+
+    # Expected directions of the padding along the four edges, leaving out the corners.
+    a, b = np.meshgrid(-1.0 + step * np.arange(-padding, size + padding),
+                       -1.0 + step * np.arange(-padding, size + padding))
+    overflow_a = np.abs(a) - 1.0
+    overflow_b = np.abs(b) - 1.0
+    edges = np.logical_xor(overflow_a > 1e-6, overflow_b > 1e-6)
+    c = 1.0 - np.maximum(np.maximum(overflow_a, overflow_b), 0.0)
+    a = np.clip(a, -1.0, 1.0)
+    b = np.clip(b, -1.0, 1.0)
+
+    max_error = 0.0
+    for index, face in enumerate(face_map):
+        x, y, z = spherical_numpy.switch_face(a, b, c, face)
+        expected = np.stack([x, y, z], 2) / np.sqrt(x ** 2.0 + y ** 2.0 + z ** 2.0)[:, :, np.newaxis]
+        max_error = max(max_error, np.abs(padded_data[index] - expected)[edges].max())
+    print("cube_pad geometry: max error {:.6f}".format(max_error))
+    assert max_error < 1e-5
+
+    # Single pixel faces have no neighbours to unfold, their pixel is replicated.
+    single_pixels = np.random.uniform(0.0, 1.0, [12, 1, 1, 3]).astype(np.float32)
+    padded_data = session.run(cube_pad(tf.constant(single_pixels), 2))
+    assert np.array_equal(padded_data, np.tile(single_pixels, [1, 5, 5, 1]))
+
 if __name__ == "__main__":
     # Global intrinsic parameters.
     K = [0.5, 0.5, 0.0, 0.0]
@@ -114,4 +266,9 @@ if __name__ == "__main__":
     rectilinear_to_equirectangular_test()
     rotate_test()
     fast_rotate_test()
-    equirectangular_to_pc_test()
\ No newline at end of file
+    equirectangular_to_pc_test()
+    numpy_backend_test()
+    vertical_sample_test()
+    wrap_sample_test()
+    cube_pad_test()
+    cube_pad_geometry_test()
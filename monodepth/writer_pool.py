@@ -0,0 +1,64 @@
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Background writers for test outputs, so that files are written while the next batch runs.
+# The task queue is bounded, so a slow disk blocks submit instead of buffering every batch in
+# memory. A failed write is raised again by the next submit, flush or close.
+
+class WriterPool(object):
+    """Output writer pool"""
+
+    def __init__(self, num_writers, max_pending = None):
+        self.num_writers = num_writers
+        self.tasks = queue.Queue(maxsize = max_pending or 4 * max(num_writers, 1))
+        self.errors = []
+        self.threads = []
+        for index in range(num_writers):
+            thread = threading.Thread(target = self.work, name = "writer_{}".format(index))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                function, arguments = task
+                function(*arguments)
+            except Exception:
+                self.errors.append(sys.exc_info()[1])
+            finally:
+                self.tasks.task_done()
+
+    def check(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def submit(self, function, *arguments):
+        self.check()
+        # Without writer threads, write on the calling thread.
+        if not self.threads:
+            function(*arguments)
+        else:
+            self.tasks.put((function, arguments))
+
+    def flush(self):
+        # Waits for all submitted writes.
+        self.tasks.join()
+        self.check()
+
+    def close(self):
+        self.tasks.join()
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.check()